@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# import_time.py
+#
+# Measures the import time of each ndmg entry point in a fresh interpreter
+# and exits non-zero if any of them is over its budget.
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+import sys
+
+# Module imported by each entry point, and its budget in seconds
+budgets = [('ndmg', 0.5),
+           ('ndmg.scripts.ndmg_cloud', 2.0),
+           ('ndmg.scripts.ndmg_bids', 15.0),
+           ('ndmg.scripts.ndmg_dwi_pipeline', 15.0)]
+
+timer = ("import time; t = time.time(); import {}; "
+         "print(time.time() - t)")
+
+
+def import_time(module, repeats=3):
+    """
+    Returns the best of `repeats` cold import times of a module, in seconds.
+    """
+    times = list()
+    for _ in range(repeats):
+        p = Popen([sys.executable, '-c', timer.format(module)],
+                  stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+        if p.returncode:
+            raise RuntimeError("Could not import {}: {}".format(module, err))
+        times += [float(out.strip())]
+    return min(times)
+
+
+def main():
+    parser = ArgumentParser(description="Checks ndmg import time budgets")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of cold imports per entry point")
+    result = parser.parse_args()
+
+    over = 0
+    for module, budget in budgets:
+        took = import_time(module, result.repeats)
+        flag = "OK" if took <= budget else "OVER BUDGET"
+        print("{}: {:.2f}s (budget {:.2f}s) {}".format(module, took, budget,
+                                                       flag))
+        over += took > budget
+    sys.exit(over)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,57 @@
-from . import *
+import importlib
+import sys
+import types
 
-# so we don't have to type ndg.graph.graph(), etc., to get the classes
-from .graph.graph import graph as graph
-from .utils import utils
-from .register.register import register as register
-from .track.track import track as track
-from .stats import *
-# from .preproc.preproc import preproc as preproc
-from .scripts import ndmg_dwi_pipeline as ndmg_dwi_pipeline
+version = "0.1.0"
 
+# so we don't have to type ndg.graph.graph(), etc., to get the classes.
+# These are resolved on first access rather than at import time, since the
+# subpackages pull in dipy, nilearn, networkx, matplotlib, plotly and vtk,
+# none of which are needed by light entry points such as `ndmg_cloud status`.
+_lazy_attrs = {
+    'graph': ('ndmg.graph.graph', 'graph'),
+    'utils': ('ndmg.utils.utils', None),
+    'register': ('ndmg.register.register', 'register'),
+    'track': ('ndmg.track.track', 'track'),
+    'stats': ('ndmg.stats', None),
+    # 'preproc': ('ndmg.preproc.preproc', 'preproc'),
+    'ndmg_dwi_pipeline': ('ndmg.scripts.ndmg_dwi_pipeline', None),
+}
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Module type which imports the attributes listed in `_lazy_attrs` when
+    they are first looked up. Lookups go through `__getattribute__` so that
+    `import ndmg.graph as mgg` still yields the class, even though importing
+    the subpackage stores the package itself on this module.
+    """
+    def __getattribute__(self, name):
+        get = types.ModuleType.__getattribute__
+        lazy = get(self, '__dict__').get('_lazy_attrs', {})
+        if name not in lazy:
+            return get(self, name)
+        cache = get(self, '_lazy_cache')
+        if name not in cache:
+            modname, attr = lazy[name]
+            obj = importlib.import_module(modname)
+            cache[name] = getattr(obj, attr) if attr is not None else obj
+        return cache[name]
+
+    def __dir__(self):
+        # Only attributes already loaded, so that tools walking dir() (e.g.
+        # unittest discovery) don't trigger the heavy imports
+        return sorted(self.__dict__.keys())
+
+
+_lazy_cache = {}
+try:
+    sys.modules[__name__].__class__ = _LazyModule
+except TypeError:
+    # Python 2 modules cannot change type, so swap in a lazy copy. The
+    # original is kept alive as its globals are cleared when it is collected.
+    _module = _LazyModule(__name__)
+    types.ModuleType.__getattribute__(_module, '__dict__').update(
+        sys.modules[__name__].__dict__)
+    _module._original = sys.modules[__name__]
+    sys.modules[__name__] = _module
@@ -28,6 +28,8 @@ import networkx as nx
 import nibabel as nb
 import ndmg
 import time
+from ndmg.graph.label_cache import load_labels, compact_labels, label_atlas
+from ndmg.graph.timeseries import roi_timeseries
 
 
 class graph(object):
@@ -50,9 +52,14 @@ class graph(object):
         self.N = N
         self.edge_dict = defaultdict(int)
 
-        self.rois = nb.load(rois).get_data()
-        n_ids = np.unique(self.rois)
-        n_ids = n_ids[n_ids != 0]
+        if isinstance(rois, np.ndarray):
+            atlas = compact_labels(rois)
+        else:
+            atlas = load_labels(rois)  # cached across graphs in a process
+        self.rois = atlas.data
+        self.n_ids = atlas.ids
+        self.counts = atlas.counts
+        n_ids = atlas.ids
 
         self.g = nx.Graph(name="Generated by NeuroData's MRI Graphs (ndmg)",
                           date=time.asctime(time.localtime()),
@@ -77,7 +84,7 @@ class graph(object):
                     - Fiber streamlines either file or array in a dipy EuDX
                       or compatible format.
         """
-        nlines = np.shape(streamlines)[0]
+        nlines = len(streamlines)
         print("# of Streamlines: " + str(nlines))
 
         for idx, streamline in enumerate(streamlines):
@@ -109,26 +116,29 @@ class graph(object):
         """
         Takes timeseries and produces a correlation matrix
 
+        Edges are the absolute correlations of each pair of distinct ROIs,
+        taken from the upper triangle of the matrix.
+
         **Positional Arguments:**
             timeseries:
                 -the timeseries file to extract correlation for.
-                          dimensions are [numrois]x[numtimesteps]
+                          dimensions are [numrois]x[numtimesteps]. An
+                          aligned 4D BOLD file may be given instead, whose
+                          ROI timeseries are then extracted first.
         """
+        if not isinstance(timeseries, np.ndarray):
+            timeseries = roi_timeseries(timeseries,
+                                        label_atlas(self.rois, None,
+                                                    self.n_ids, self.counts))
         print("Estimating correlation matrix for {} ROIs...".format(self.N))
         cor = np.corrcoef(timeseries)  # calculate pearson correlation
 
-        roilist = np.unique(self.rois)
-        roilist = roilist[roilist != 0]
-        roilist = np.sort(roilist)
-
-        for (idx_out, roi_out) in enumerate(roilist):
-            for (idx_in, roi_in) in enumerate(roilist):
-                self.edge_dict[tuple((roi_out, roi_in))] = float(np.absolute(
-                    cor[idx_out, idx_in]))
-
-        edge_list = [(k[0], k[1], v) for k, v in self.edge_dict.items()]
-
-        self.g.add_weighted_edges_from(edge_list)
+        roilist = self.n_ids
+        rows, cols = np.triu_indices(len(roilist), 1)
+        weights = np.absolute(cor[rows, cols])
+        self.g.add_weighted_edges_from(zip(roilist[rows].tolist(),
+                                           roilist[cols].tolist(),
+                                           weights.tolist()))
         pass
 
     def get_graph(self):
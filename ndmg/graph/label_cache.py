@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# label_cache.py
+
+from collections import namedtuple
+
+import numpy as np
+import nibabel as nb
+import os.path as op
+
+# A parcellation: label volume, affine, sorted non-zero label IDs (the graph
+# nodes) and the number of voxels of each
+label_atlas = namedtuple('label_atlas', ['data', 'affine', 'ids', 'counts'])
+
+_cache = dict()  # parcellations loaded by this process, by absolute path
+_bundles = []  # compiled atlas bundles parcellations are looked up in first
+
+
+def compact_dtype(minval, maxval):
+    """
+    Smallest integer dtype holding label values in [minval, maxval].
+    """
+    for dtype in [np.uint8, np.uint16, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= minval and maxval <= info.max:
+            return dtype
+    return np.int64
+
+
+def label_ids(data):
+    """
+    Sorted non-zero label values of a label volume and their voxel counts.
+    """
+    flat = np.ravel(data)
+    if flat.size and np.min(flat) >= 0:
+        counts = np.bincount(flat)
+        ids = np.nonzero(counts)[0]
+        ids = ids[ids != 0]
+        return ids.astype(data.dtype), counts[ids]
+    ids, counts = np.unique(flat, return_counts=True)
+    keep = ids != 0
+    return ids[keep], counts[keep]
+
+
+def compact_labels(data, affine=None):
+    """
+    A label_atlas of a label volume, converted to its compact dtype.
+    """
+    data = np.asarray(data)
+    if data.size:
+        data = np.rint(data).astype(compact_dtype(np.min(data), np.max(data)))
+    ids, counts = label_ids(data)
+    return label_atlas(data, affine, ids, counts)
+
+
+def load_labels(path):
+    """
+    Loads a parcellation, decompressing each file only once per process:
+    later calls return the cached label_atlas, unless the file has changed
+    since. Parcellations in a bundle registered with use_bundle are
+    memory-mapped from it instead. The volume must not be modified.
+
+    **Positional Arguments:**
+
+            path:
+                - Nifti label file
+    """
+    for bundle in _bundles:
+        atlas = bundle.labels(path)
+        if atlas is not None:
+            return atlas
+    key = op.abspath(path)
+    mtime = op.getmtime(key)
+    if key not in _cache or _cache[key][0] != mtime:
+        img = nb.load(key)
+        _cache[key] = (mtime, compact_labels(np.asanyarray(img.dataobj),
+                                              img.affine))
+    return _cache[key][1]
+
+
+def use_bundle(bundle):
+    """
+    Looks up parcellations in a compiled atlas bundle (see
+    ndmg.utils.atlas_bundle) before loading their files. A bundle whose file
+    is already registered is ignored; returns whether it was added.
+    """
+    path = op.abspath(bundle.path)
+    if any(op.abspath(b.path) == path for b in _bundles):
+        return False
+    _bundles.append(bundle)
+    return True
+
+
+def clear_labels():
+    """
+    Empties the parcellation cache and forgets registered bundles.
+    """
+    _cache.clear()
+    del _bundles[:]
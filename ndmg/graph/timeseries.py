@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# timeseries.py
+
+from ndmg.graph.label_cache import load_labels, compact_labels
+
+import numpy as np
+import nibabel as nb
+
+chunk_bytes = 2**28  # most BOLD data read at once
+
+
+def roi_timeseries(func, rois, chunk_bytes=chunk_bytes):
+    """
+    Mean timeseries of every ROI of a parcellation in an atlas-aligned 4D
+    BOLD image, as a [numrois]x[numtimesteps] array with ROIs in sorted
+    label order (the node order of ndmg.graph.graph).
+
+    Volumes are read a chunk at a time through nibabel's array proxy, and
+    each chunk is reduced to per-ROI sums with one bincount over all of its
+    in-ROI voxels and timepoints.
+
+    **Positional Arguments:**
+
+            func:
+                - Aligned 4D BOLD image file
+            rois:
+                - Parcellation, as a Nifti file, label array or label_atlas
+                  (see ndmg.graph.label_cache)
+
+    **Optional Arguments:**
+
+            chunk_bytes:
+                - Most BOLD data read at once
+    """
+    if isinstance(rois, np.ndarray):
+        rois = compact_labels(rois)
+    elif not hasattr(rois, 'ids'):
+        rois = load_labels(rois)
+    proxy = nb.load(func).dataobj
+    shape = proxy.shape
+    if tuple(shape[:3]) != tuple(rois.data.shape):
+        raise ValueError("BOLD volumes {} and parcellation {} differ in "
+                         "shape".format(shape[:3], rois.data.shape))
+    T = shape[3] if len(shape) > 3 else 1
+
+    # Row of each in-ROI voxel, in flat (C) order
+    labels = np.asarray(rois.data).ravel()
+    vox = np.nonzero(labels)[0]
+    rows = np.searchsorted(rois.ids, labels[vox])
+    L = len(rois.ids)
+
+    sums = np.zeros((L, T))
+    step = max(1, int(chunk_bytes // (8 * np.prod(shape[:3]))))
+    for start in range(0, T, step):
+        if len(shape) > 3:
+            chunk = np.asarray(proxy[..., start:start + step])
+        else:
+            chunk = np.asarray(proxy)[..., None]
+        n = chunk.shape[-1]
+        vals = chunk.reshape(-1, n)[vox]
+        idx = rows[:, None] * n + np.arange(n)[None, :]
+        sums[:, start:start + n] = np.bincount(
+            idx.ravel(), weights=vals.ravel().astype(np.float64),
+            minlength=L * n).reshape(L, n)
+    return sums / np.asarray(rois.counts, dtype=np.float64)[:, None]
@@ -19,74 +19,156 @@
 # Created by Greg Kiar and Will Gray Roncal on 2016-01-27.
 # Email: gkiar@jhu.edu, wgr@jhu.edu
 
+from __future__ import print_function
+
 from argparse import ArgumentParser
 from datetime import datetime
-from subprocess import Popen, PIPE
+from multiprocessing import Pool
+import os
 import os.path as op
-import nibabel as nb
 import ndmg.graph as mgg
 import ndmg.utils as mgu
-import numpy as np
+from ndmg.track.fiber_store import load_fibers, compact_fibers
+from ndmg.graph.label_cache import load_labels
+
+_loaded = dict()  # fibers loaded by this (worker) process, by filename
 
 
-def multigraphs(fibers, labels, outdir, gformat='gpickle'):
+def find_fibers(paths):
+    """
+    Expands fiber files and directories (searched recursively for
+    *_fibers.npz files) into a sorted list of fiber files.
+    """
+    if not isinstance(paths, list):
+        paths = [paths]
+    fibers = []
+    for path in paths:
+        if op.isdir(path):
+            fibers += [op.join(root, fl)
+                       for root, dirs, files in os.walk(path)
+                       for fl in files if fl.endswith('_fibers.npz')]
+        else:
+            fibers += [path]
+    return sorted(fibers)
+
+
+def _make_graph(args):
     """
-    Creates a brain graph from fiber streamlines
+    Builds and saves the graph of one fiber file for one parcellation.
+    Streamlines are memory-mapped, so workers share the file's pages rather
+    than each holding a copy, and reopening a file only reads its offsets.
+    """
+    fibers, label, graph, gformat = args
+    try:
+        if fibers not in _loaded:
+            _loaded.clear()
+            _loaded[fibers] = load_fibers(fibers)
+        tracks = _loaded[fibers]
+        g1 = mgg(len(load_labels(label).ids), label)
+        g1.make_graph(tracks)
+        g1.summary()
+        g1.save_graph(graph, fmt=gformat)
+        return (graph, None)
+    except Exception as e:
+        return (graph, str(e))
+
+
+def multigraphs(fibers, labels, outdir, gformat='gpickle', nproc=None,
+                overwrite=True):
+    """
+    Creates brain graphs from fiber streamlines, for one or more fiber files
+    and parcellations, building the graphs in parallel.
+
+    **Positional Arguments:**
+
+            fibers:
+                - Fiber file, or list of fiber files or directories of them
+            labels:
+                - List of parcellation files
+            outdir:
+                - Path to which graphs will be stored
+
+    **Optional Arguments:**
+
+            gformat:
+                - Output graph format
+            nproc:
+                - Number of worker processes (defaults to the number of CPUs)
+            overwrite:
+                - Whether to rebuild graphs which already exist; without it,
+                  only graphs for new fiber files or parcellations are built
     """
     startTime = datetime.now()
-    fiber_name = mgu.get_filename(fibers)
-    base = fiber_name.split('_fibers', 1)[0]
+    fibers = find_fibers(fibers)
+
     # Create output directories for graphs
     label_name = [mgu.get_filename(x) for x in labels]
     for label in label_name:
-        p = Popen("mkdir -p " + outdir + "/graphs/" + label,
-                  stdout=PIPE, stderr=PIPE, shell=True)
-
-    # Create names of files to be produced
-    graphs = [op.join(outdir, "graphs", x, "{}_{}.{}".format(base, x, gformat))
-              for x in label_name]
-    print "Graphs of streamlines downsampled to given labels: " +\
-          (", ".join([x for x in graphs]))
-
-    # Load fibers
-    print "Loading fibers..."
-    fiber_npz = np.load(fibers)
-    tracks = fiber_npz[fiber_npz.keys()[0]]
-
-    # Generate graphs from streamlines for each parcellation
-    for idx, label in enumerate(label_name):
-        print "Generating graph for " + label + " parcellation..."
-        labels_im = nb.load(labels[idx])
-        g1 = mgg(len(np.unique(labels_im.get_data()))-1, labels[idx])
-        g1.make_graph(tracks)
-        g1.summary()
-        g1.save_graph(graphs[idx])
-
-    print "Execution took: " + str(datetime.now() - startTime)
-    print "Complete!"
-    pass
+        gdir = op.join(outdir, "graphs", label)
+        if not op.isdir(gdir):
+            os.makedirs(gdir)
+
+    # Create names of files to be produced, grouped by fiber file
+    jobs = []
+    for fiber in fibers:
+        base = mgu.get_filename(fiber).split('_fibers', 1)[0]
+        graphs = [(labels[idx], op.join(outdir, "graphs", label,
+                                        "{}_{}.{}".format(base, label,
+                                                          gformat)))
+                  for idx, label in enumerate(label_name)]
+        graphs = [(l, g) for l, g in graphs if overwrite or not op.isfile(g)]
+        if graphs:
+            # Fibers in the old pickled format are converted once, here,
+            # so that workers memory-map them rather than each unpickling
+            # a private copy
+            fiber = compact_fibers(fiber, op.join(outdir, "tmp", "fibers"))
+        jobs += [(fiber, label, graph, gformat) for label, graph in graphs]
+    print("Generating {} graphs from {} fiber files and {} "
+          "parcellations...".format(len(jobs), len(fibers), len(labels)))
+
+    if nproc == 1 or len(jobs) < 2:
+        results = [_make_graph(job) for job in jobs]
+    else:
+        pool = Pool(nproc)
+        try:
+            results = pool.map(_make_graph, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    failed = [(graph, err) for graph, err in results if err is not None]
+    for graph, err in failed:
+        print("Failed to generate {}: {}".format(graph, err))
+    print("Generated {} of {} graphs".format(len(results) - len(failed),
+                                             len(results)))
+    print("Execution took: " + str(datetime.now() - startTime))
+    print("Complete!")
 
 
 def main():
     parser = ArgumentParser(description="This is an end-to-end connectome \
                             estimation pipeline from sMRI and DTI images")
-    parser.add_argument("fibers", action="store", help="DTI streamlines")
+    parser.add_argument("fibers", action="store", help="DTI streamlines, or \
+                        a directory of them")
     parser.add_argument("outdir", action="store", help="Path to which \
                         derivatives will be stored")
     parser.add_argument("labels", action="store", nargs="*", help="Nifti \
                         labels of regions of interest in atlas space")
+    parser.add_argument("-n", "--nproc", action="store", type=int,
+                        default=None, help="Number of worker processes")
+    parser.add_argument("-s", "--skip_existing", action="store_true",
+                        help="Only build graphs which do not exist yet")
     result = parser.parse_args()
 
     # Create output directory
-    cmd = "mkdir -p " + result.outdir + " " + result.outdir + "/tmp"
-    print "Creating output directory: " + result.outdir
-    print "Creating output temp directory: " + result.outdir + "/tmp"
-    p = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
-    p.communicate()
+    print("Creating output directory: " + result.outdir)
+    print("Creating output temp directory: " + result.outdir + "/tmp")
+    if not op.isdir(op.join(result.outdir, "tmp")):
+        os.makedirs(op.join(result.outdir, "tmp"))
 
-    multigraphs(result.fibers, result.labels, result.outdir)
+    multigraphs(result.fibers, result.labels, result.outdir,
+                nproc=result.nproc, overwrite=not result.skip_existing)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ndmg_atlas_compile.py
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from ndmg.scripts.ndmg_bids import get_atlas, atlas_dir
+from ndmg.utils.atlas_bundle import compile_bundle, default_bundle
+
+
+def main():
+    parser = ArgumentParser(description="Compiles the parcellations of an "
+                            "atlas directory into one memory-mappable "
+                            "bundle, which sessions then read them from.")
+    parser.add_argument("atlas_dir", action="store", nargs="?",
+                        default=atlas_dir, help="Atlas directory (the one "
+                        "ndmg_bids uses by default)")
+    parser.add_argument("--fmri", action="store_true", help="Compile the "
+                        "fMRI atlases instead of the DWI ones")
+    parser.add_argument("--out", action="store", default=None, help="Bundle "
+                        "file (by default in the atlas directory, where "
+                        "ndmg_bids looks for it)")
+    result = parser.parse_args()
+
+    dwi = not result.fmri
+    labels = get_atlas(result.atlas_dir, dwi)[0]
+    out = result.out
+    if out is None:
+        out = default_bundle(result.atlas_dir, dwi)
+    compile_bundle(labels, out)
+    print("Atlas bundle written to {}".format(out))
+
+
+if __name__ == "__main__":
+    main()
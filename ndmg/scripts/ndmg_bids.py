@@ -21,18 +21,25 @@
 
 from argparse import ArgumentParser
 from subprocess import Popen, PIPE
+from multiprocessing import Process, cpu_count
 from os.path import expanduser
 from ndmg.scripts.ndmg_setup import get_files
 from ndmg.scripts.ndmg_dwi_pipeline import ndmg_dwi_pipeline
 from ndmg.utils.bids import *
 from ndmg.stats.qa_graphs import *
 from ndmg.stats.qa_graphs_plotting import *
+from ndmg.stats.graph_stack import dense_max_nodes, stack_cell_bytes, \
+    stack_subjects
+from ndmg.utils.loadGraphs import read_graph
+from ndmg.utils.atlas_bundle import default_bundle, load_bundle
+from ndmg.graph.label_cache import use_bundle
 from glob import glob
 import ndmg.utils as mgu
 import ndmg
 import os.path as op
 import os
 import sys
+import time
 
 
 atlas_dir = '/ndmg_atlases'  # This location bc it is convenient for containers
@@ -49,8 +56,8 @@ atlas_dir = '/ndmg_atlases'  # This location bc it is convenient for containers
 #
 # *these files can be anywhere up stream of the dwi data, and are inherited.
 
-skippers = ['slab907', 'slab1068', 'DS01216', 'DS01876',
-            'DS03231', 'DS06481', 'DS16784', 'DS72784']
+graph_overhead = 4  # loaded graph size relative to a dense float matrix
+stack_bytes = 2**29  # cap on the stacked arrays of compute_metrics
 
 def get_atlas(atlas_dir, dwi=True):
     """
@@ -92,6 +99,11 @@ def get_atlas(atlas_dir, dwi=True):
         print("Source: s3://mrneurodata/data/resources/ndmg_atlases.zip")
         print("Destination: {}".format(atlas_dir))
 
+    # Parcellations are mapped from a compiled bundle (ndmg_atlas_compile)
+    bundle = default_bundle(atlas_dir, dwi)
+    if op.isfile(bundle) and use_bundle(load_bundle(bundle)):
+        print("Using compiled atlas bundle: {}".format(bundle))
+
     if dwi:
         atlas_brain = None
         lv_mask = None
@@ -129,11 +141,97 @@ def session_level(inDir, outDir, subjs, sesh=None, debug=False,
                               atlas_mask, labels, outDir, clean=(not debug))
 
 
+def multi_session_level(inDir, outDir, sessions, bucket=None, remote=None,
+                        creds=False, debug=False):
+    """
+    Processes several (participant, session) pairs in one process, fetching
+    each session from S3 just before it is needed and removing the raw data
+    again afterwards. A failing session is reported and the rest continue;
+    returns the sessions which failed.
+    """
+    failed = []
+    for sub, sesh in sessions:
+        tail = 'sub-{}'.format(sub)
+        if sesh is not None:
+            tail = op.join(tail, 'ses-{}'.format(sesh))
+        print("Session: {}".format(tail))
+        tindir = op.join(inDir, tail)
+        try:
+            if bucket is not None and remote is not None:
+                s3_get_data(bucket, op.join(remote, tail), tindir,
+                            public=creds)
+            session_level(inDir, outDir, [sub], sesh, debug)
+        except Exception as e:
+            print("Failed processing for {}.".format(tail))
+            print(e)
+            failed += [tail]
+        finally:
+            if bucket is not None and remote is not None:
+                mgu.execute_cmd("rm -rf {}".format(tindir))
+    return failed
+
+
+def atlas_memory(nodes, nsubj, nproc=1):
+    """
+    Rough peak memory in bytes of the group analysis of one parcellation,
+    from its node count, number of graphs and number of worker processes:
+    the loaded graphs, the copy of a graph held by each worker, the stacked
+    per-subject arrays (with the float32 clustering temporaries) and a few
+    dense study-wide matrices.
+    """
+    dense = 8 * nodes**2
+    if nodes > dense_max_nodes:
+        stack = 0  # graphs are then processed one at a time, sparsely
+    else:
+        stack = min(stack_subjects(nodes, stack_bytes), nsubj) * \
+            (stack_cell_bytes + 8) * nodes**2
+    return (nsubj + nproc) * dense * graph_overhead + stack + 4 * dense
+
+
+def physical_memory():
+    """
+    Physical memory of this machine in bytes, or None if it is unknown.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def atlas_level(fs, outDir, label, dataset=None, minimal=False, log=False,
+                hemispheres=False, nproc=None):
+    """
+    Computes qc metrics and plots for the graphs of one parcellation, with
+    `nproc` worker processes. Meant to run in its own process: failures are
+    reported and the exit code set.
+    """
+    try:
+        compute_metrics(fs, outDir, label, nproc=nproc,
+                        stack_bytes=stack_bytes)
+        outf = op.join(outDir, '{}_plot'.format(label))
+        make_panel_plot(outDir, outf, dataset=dataset, atlas=label,
+                        minimal=minimal, log=log, hemispheres=hemispheres)
+    except Exception as e:
+        print("Failed group analysis for {} parcellation.".format(label))
+        print(e)
+        sys.exit(1)
+
+
 def group_level(inDir, outDir, dataset=None, atlas=None, minimal=False,
-                log=False, hemispheres=False, dwi=True):
+                log=False, hemispheres=False, dwi=True, nproc=None,
+                memory=None, skip=None):
     """
     Crawls the output directory from ndmg and computes qc metrics on the
     derivatives produced
+
+    Parcellations are processed in parallel, one process each, largest
+    (by estimated memory) first so that the longest ones do not start last.
+    A parcellation is only started while the estimates of those running fit
+    in `memory` bytes (physical memory by default); `nproc` bounds the number
+    running at once (number of CPUs by default). The CPUs are split between
+    the parcellations that can run at once, each getting that share as
+    worker processes for its metrics. Parcellations listed in `skip` are
+    left out.
     """
     if not dwi:
         print("Currently there is no group level analysis for fmri.")
@@ -147,30 +245,63 @@ def group_level(inDir, outDir, dataset=None, atlas=None, minimal=False,
     if atlas is not None:
         labels_used = [atlas]
 
-    for skip in skippers:
-        if skip in labels_used:
-            print("Skipping {} parcellation".format(skip))
-            labels_used.remove(skip)
-            continue
+    for label in skip or []:
+        if label in labels_used:
+            print("Skipping {} parcellation".format(label))
+            labels_used.remove(label)
 
+    if nproc is None:
+        nproc = cpu_count()
+    if memory is None:
+        memory = physical_memory()
+
+    workers = max(1, cpu_count() // max(1, min(nproc, len(labels_used))))
+    jobs = []
     for label in labels_used:
-        print("Parcellation: {}".format(label))
         tmp_in = op.join(inDir, label)
         fs = [op.join(tmp_in, fl)
               for root, dirs, files in os.walk(tmp_in)
               for fl in files
               if fl.endswith(".graphml") or fl.endswith(".gpickle") or fl.endswith('edgelist')]
-        tmp_out = op.join(outDir, label)
-        mgu.execute_cmd("mkdir -p {}".format(tmp_out))
         try:
-            compute_metrics(fs, tmp_out, label)
-            outf = op.join(tmp_out, '{}_plot'.format(label))
-            make_panel_plot(tmp_out, outf, dataset=dataset, atlas=label,
-                            minimal=minimal, log=log, hemispheres=hemispheres)
-        except Exception as e:
-            print("Failed group analysis for {} parcellation.".format(label))
-            print(e)
+            nodes = read_graph(fs[0]).number_of_nodes() if fs else 0
+        except Exception:
+            nodes = 0
+        jobs += [(atlas_memory(nodes, len(fs), workers), label, fs)]
+    jobs = sorted(jobs, key=lambda job: job[0], reverse=True)
+
+    running = dict()
+    failed = []
+    used = 0
+    while jobs or running:
+        for label in list(running.keys()):
+            proc, mem = running[label]
+            if not proc.is_alive():
+                proc.join()
+                used -= mem
+                del running[label]
+                if proc.exitcode != 0:
+                    failed += [label]
+        # Largest waiting parcellation which fits next to the running ones
+        fits = [job for job in jobs if not running or memory is None or
+                used + job[0] <= memory]
+        if fits and len(running) < nproc:
+            mem, label, fs = fits[0]
+            jobs.remove(fits[0])
+            print("Parcellation: {} (~{:.1f} GB)".format(label, mem/1e9))
+            tmp_out = op.join(outDir, label)
+            mgu.execute_cmd("mkdir -p {}".format(tmp_out))
+            proc = Process(target=atlas_level,
+                           args=(fs, tmp_out, label, dataset, minimal, log,
+                                 hemispheres, workers))
+            proc.start()
+            running[label] = (proc, mem)
+            used += mem
             continue
+        time.sleep(1)
+
+    if failed:
+        print("Group analysis failed for: {}".format(", ".join(failed)))
 
 
 def main():
@@ -202,6 +333,10 @@ def main():
                         'parameter is not provided all sessions should be '
                         'analyzed. Multiple sessions can be specified '
                         'with a space separated list.')
+    parser.add_argument('--session_list', action='store', help='A json list '
+                        'of sessions (local or s3://) produced by ndmg_cloud '
+                        'for array jobs. The participant and session are '
+                        'picked by the AWS_BATCH_JOB_ARRAY_INDEX variable.')
     parser.add_argument('--bucket', action='store', help='The name of '
                         'an S3 bucket which holds BIDS organized data. You '
                         'must have built your bucket with credentials to the '
@@ -223,6 +358,8 @@ def main():
                         default=False)
     parser.add_argument('--log', action='store_true', help='Determines '
                         'axis scale for plotting.', default=False)
+    parser.add_argument('--skip', action='store', nargs='+',
+                        help='Parcellations to leave out of group analysis.')
     parser.add_argument('--debug', action='store_true', help='flag to store '
                         'temp files along the path of processing.',
                         default=False)
@@ -232,6 +369,7 @@ def main():
     outDir = result.output_dir
     subj = result.participant_label
     sesh = result.session_label
+    slist = result.session_list
     buck = result.bucket
     remo = result.remote_path
     push = result.push_data
@@ -243,6 +381,7 @@ def main():
     atlas = result.atlas
     dataset = result.dataset
     hemi = result.hemispheres
+    skip = result.skip
 
     creds = bool(os.getenv("AWS_ACCESS_KEY_ID", 0) and
                  os.getenv("AWS_SECRET_ACCESS_KEY", 0))
@@ -250,7 +389,14 @@ def main():
     # Since old interfaces only support participant level but we truly do session.
     level = 'session' if level == 'participant' else level
 
-    if level == 'session':
+    failed = []
+    if level == 'session' and slist is not None:
+        modif = 'ndmg'
+        sessions = get_array_sessions(slist)
+        failed = multi_session_level(inDir, outDir, sessions, buck, remo,
+                                     creds, debug)
+
+    elif level == 'session':
         if buck is not None and remo is not None:
             print("Retrieving data from S3...")
             if subj is not None:
@@ -279,12 +425,18 @@ def main():
                 tindir = op.join(outDir, 'graphs')
             s3_get_data(buck, tpath, tindir, public=creds)
         modif = 'qa'
-        group_level(op.join(outDir, 'graphs'), outDir, dataset, atlas, minimal, log, hemi)
+        group_level(op.join(outDir, 'graphs'), outDir, dataset, atlas,
+                    minimal, log, hemi, skip=skip)
 
     if push and buck is not None and remo is not None:
         print("Pushing results to S3...")
         s3_push_data(buck, remo, outDir, modif, creds)
 
+    # Results of the sessions which succeeded are pushed above, but the job
+    # must still fail so that the failures show up in its status
+    if failed:
+        sys.exit("Processing failed for: {}".format(", ".join(failed)))
+
 
 if __name__ == "__main__":
     main()
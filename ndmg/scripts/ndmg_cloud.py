@@ -20,70 +20,196 @@
 # Email: gkiar@jhu.edu
 
 from argparse import ArgumentParser
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from copy import deepcopy
+from multiprocessing.pool import ThreadPool
 import ndmg.utils as mgu
 import ndmg
 import sys
 import os
 import re
+import time
 import csv
 import boto3
 import json
-import ast
 
+max_array_size = 10000  # AWS Batch limit on the number of array children
+# Runtime model used when packing sessions (--pack). These are rough,
+# conservative guesses rather than measurements; tune them for a dataset
+# from the runtimes of previous jobs with --job_overhead and --sec_per_mb.
+job_overhead = 600  # s; container start, atlas loading, S3 setup
+sec_per_mb = 60.0  # s of processing per MB of (compressed) session input
+all_states = ['SUBMITTED', 'PENDING', 'RUNNABLE', 'STARTING', 'RUNNING',
+              'SUCCEEDED', 'FAILED']
+done_states = ['SUCCEEDED', 'FAILED']
 participant_templ = 'https://raw.githubusercontent.com/neurodata/ndmg/master/templates/ndmg_cloud_participant.json'
 group_templ = 'https://raw.githubusercontent.com/neurodata/ndmg/master/templates/ndmg_cloud_group.json'
 
 
 def batch_submit(bucket, path, jobdir, credentials=None, state='session',
-                 debug=False, dataset=None, log=False):
+                 debug=False, dataset=None, log=False, array=False,
+                 pack=None, overhead=job_overhead, rate=sec_per_mb,
+                 skip=None):
     """
     Searches through an S3 bucket, gets all subject-ids, creates json files
     for each, submits batch jobs, and returns list of job ids to query status
-    upon later.
+    upon later. With `array`, sessions are submitted as children of a single
+    array job rather than as one job each. With `pack` (hours), sessions are
+    grouped into array children of up to that estimated runtime, modelled
+    as `overhead` seconds per job plus `rate` seconds per MB of input.
+    Group jobs are made for every parcellation not listed in `skip`.
     """
     group = state == 'group'
     print("Getting list from s3://{}/{}/...".format(bucket, path))
-    threads = crawl_bucket(bucket, path, group)
+    bins = None
+    if pack is not None and not group:
+        threads, sizes = crawl_bucket(bucket, path, group, sizes=True)
+        bins = pack_sessions(sizes, pack*3600, overhead, rate)
+        array = True
+    else:
+        threads = crawl_bucket(bucket, path, group)
 
     print("Generating job for each subject...")
     jobs = create_json(bucket, path, threads, jobdir, group, credentials,
-                       debug, dataset, log)
+                       debug, dataset, log, array, bins, skip)
 
     print("Submitting jobs to the queue...")
     ids = submit_jobs(jobs, jobdir)
 
 
-def crawl_bucket(bucket, path, group=False):
+def crawl_bucket(bucket, path, group=False, client=None, workers=16,
+                 sizes=False):
     """
     Gets subject list for a given S3 bucket and path
+
+    Prefixes are discovered with paginated `list_objects_v2` calls rather than
+    one `aws s3 ls` per subject; the per-subject listings are spread over a
+    bounded thread pool. A pre-configured client (e.g. pointed at a local S3
+    stand-in) can be passed through `client`. With `sizes`, the total bytes
+    of input for each (subject, session) are returned alongside; this needs
+    every object below each subject to be listed, so without it only the
+    session prefixes are.
     """
+    if client is None:
+        client = boto3.client('s3')
     if group:
-        cmd = 'aws s3 ls s3://{}/{}/graphs/'.format(bucket, path)
-        out, err = mgu.execute_cmd(cmd)
-        atlases = re.findall('PRE (.+)/', out)
+        prefixes = list_prefixes(client, bucket, '{}/graphs/'.format(path))
+        atlases = [p.rstrip('/').split('/')[-1] for p in prefixes]
         print("Atlas IDs: " + ", ".join(atlases))
         return atlases
     else:
-        cmd = 'aws s3 ls s3://{}/{}/'.format(bucket, path)
-        out, err = mgu.execute_cmd(cmd)
-        subjs = re.findall('PRE sub-(.+)/', out)
-        cmd = 'aws s3 ls s3://{}/{}/sub-{}/'
-        seshs = OrderedDict()
-        for subj in subjs:
-            out, err = mgu.execute_cmd(cmd.format(bucket, path, subj))
-            sesh = re.findall('ses-(.+)/', out)
-            seshs[subj] = sesh if sesh != [] else [None]
+        prefixes = list_prefixes(client, bucket, '{}/'.format(path))
+        subjs = sorted(p.rstrip('/').split('/')[-1][len('sub-'):]
+                       for p in prefixes
+                       if p.rstrip('/').split('/')[-1].startswith('sub-'))
+
+        def crawl_subject(subj):
+            sub_prefix = '{}/sub-{}/'.format(path, subj)
+            if not sizes:
+                tops = [p[len(sub_prefix):].rstrip('/')
+                        for p in list_prefixes(client, bucket, sub_prefix)]
+                sesh = sorted(t[len('ses-'):] for t in tops
+                              if t.startswith('ses-'))
+                return (sesh if sesh != [] else [None]), None
+            nbytes = Counter()
+            for key, size in list_objects(client, bucket, sub_prefix):
+                top = key[len(sub_prefix):].split('/')[0]
+                sesh = top[len('ses-'):] if top.startswith('ses-') else None
+                nbytes[sesh] += size
+            sesh = sorted(s for s in nbytes.keys() if s is not None)
+            if sesh == []:
+                sesh = [None]
+            # Files above the session level (e.g. bvals) are shared by all
+            shared = nbytes[None] if sesh != [None] else 0
+            return sesh, dict(((subj, s), nbytes[s] + shared) for s in sesh)
+
+        pool = ThreadPool(max(1, min(workers, len(subjs))))
+        try:
+            found = pool.map(crawl_subject, subjs)
+        finally:
+            pool.close()
+            pool.join()
+        seshs = OrderedDict((subj, f[0]) for subj, f in zip(subjs, found))
         print("Session IDs: " + ", ".join([subj+'-'+sesh if sesh is not None
                                            else subj
                                            for subj in subjs
                                            for sesh in seshs[subj]]))
+        if sizes:
+            nbytes = OrderedDict((k, f[1][k]) for subj, f in zip(subjs, found)
+                                 for k in sorted(f[1].keys()))
+            return seshs, nbytes
         return seshs
 
 
+def list_prefixes(client, bucket, prefix):
+    """
+    Returns the common prefixes (i.e. "directories") directly below the given
+    prefix, following pagination of the S3 listing.
+    """
+    paginator = client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+    return [cp['Prefix']
+            for page in pages
+            for cp in page.get('CommonPrefixes', [])]
+
+
+def list_objects(client, bucket, prefix):
+    """
+    Returns (key, size) for every object below the given prefix, following
+    pagination of the S3 listing.
+    """
+    paginator = client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
+    return [(obj['Key'], obj['Size'])
+            for page in pages
+            for obj in page.get('Contents', [])]
+
+
+def estimate_runtime(nbytes, rate=sec_per_mb):
+    """
+    Estimates the runtime (s) of processing one session from the size of its
+    input at `rate` seconds per MB, excluding the fixed per-job overhead.
+    """
+    return rate * nbytes / 1024.0**2
+
+
+def pack_sessions(sizes, budget, overhead=job_overhead, rate=sec_per_mb):
+    """
+    Groups sessions into jobs whose estimated runtime (including a single
+    per-job overhead) stays within `budget` seconds, using first-fit
+    decreasing. Sessions which alone exceed the budget get their own job.
+
+    Required parameters:
+        sizes:
+            - Dictionary of (subject, session) to bytes of input
+        budget:
+            - Target runtime of each job in seconds
+    Optional parameters:
+        overhead:
+            - Fixed runtime of each job in seconds
+        rate:
+            - Runtime in seconds per MB of session input
+    """
+    costs = dict((k, estimate_runtime(v, rate)) for k, v in sizes.items())
+    bins = list()
+    loads = list()
+    for key in sorted(costs.keys(), key=lambda k: -costs[k]):
+        for idx, load in enumerate(loads):
+            if load + costs[key] <= budget:
+                bins[idx] += [key]
+                loads[idx] += costs[key]
+                break
+        else:
+            bins += [[key]]
+            loads += [overhead + costs[key]]
+    print("Packed {} sessions into {} jobs (~{:.1f}h each)".format(
+          len(costs), len(bins), sum(loads)/max(len(loads), 1)/3600.0))
+    return bins
+
+
 def create_json(bucket, path, threads, jobdir, group=False, credentials=None,
-                debug=False, dataset=None, log=False):
+                debug=False, dataset=None, log=False, array=False, bins=None,
+                skip=None):
     """
     Takes parameters to make jsons
     """
@@ -128,9 +254,8 @@ def create_json(bucket, path, threads, jobdir, group=False, credentials=None,
         else:
             cmd[9] = re.sub('(<DATASET>)', '', cmd[9])
 
-        batlas = ['slab907', 'DS03231', 'DS06481', 'DS16784', 'DS72784']
         for atlas in atlases:
-            if atlas in batlas:
+            if skip is not None and atlas in skip:
                 print("... Skipping {} parcellation".format(atlas))
                 continue
             print("... Generating job for {} parcellation".format(atlas))
@@ -154,6 +279,9 @@ def create_json(bucket, path, threads, jobdir, group=False, credentials=None,
                 json.dump(job_json, outfile)
             jobs += [job]
 
+    elif array:
+        jobs = create_array_json(bucket, path, seshs, template, jobdir, debug,
+                                 dataset, bins=bins)
     else:
         for subj in seshs.keys():
             print("... Generating job for sub-{}".format(subj))
@@ -183,17 +311,73 @@ def create_json(bucket, path, threads, jobdir, group=False, credentials=None,
     return jobs
 
 
-def submit_jobs(jobs, jobdir):
+def create_array_json(bucket, path, seshs, template, jobdir, debug=False,
+                      dataset=None, client=None, bins=None):
+    """
+    Writes the list of sessions to process, uploads it next to the dataset,
+    and makes array job jsons whose children each pick their sessions from
+    the list by `AWS_BATCH_JOB_ARRAY_INDEX`. Each child processes one session,
+    or one bin of sessions when `bins` (see `pack_sessions`) is given.
+    """
+    if client is None:
+        client = boto3.client('s3')
+    if bins is None:
+        bins = [[(subj, sesh)] for subj in seshs.keys()
+                for sesh in seshs[subj]]
+    sessions = [[{'participant_label': subj, 'session_label': sesh}
+                 for subj, sesh in b] for b in bins]
+
+    ver = ndmg.version.replace('.', '-')
+    if dataset:
+        base = 'ndmg_{}_{}'.format(ver, dataset)
+    else:
+        base = 'ndmg_{}'.format(ver)
+
+    cmd = template['containerOverrides']['command']
+    jobs = list()
+    for idx, start in enumerate(range(0, len(sessions), max_array_size)):
+        chunk = sessions[start:start + max_array_size]
+        name = '{}_array-{}'.format(base, idx)
+        print("... Generating array job {} ({} children)".format(name,
+                                                                 len(chunk)))
+        key = '{}/ndmg_jobs/{}_sessions.json'.format(path, name)
+        client.put_object(Bucket=bucket, Key=key, Body=json.dumps(chunk))
+        with open(os.path.join(jobdir, 'jobs', name+'_sessions.json'),
+                  'w') as outfile:
+            json.dump(chunk, outfile)
+
+        # Swap the single participant for the session list
+        job_cmd = deepcopy(cmd[:7]) + [u'--session_list',
+                                       u's3://{}/{}'.format(bucket, key)]
+        job_cmd += deepcopy(cmd[9:])
+        if debug:
+            job_cmd += [u'--debug']
+
+        job_json = deepcopy(template)
+        job_json['jobName'] = name
+        job_json['containerOverrides']['command'] = job_cmd
+        if len(chunk) > 1:  # Batch requires at least 2 array children
+            job_json['arrayProperties'] = {'size': len(chunk)}
+        job = os.path.join(jobdir, 'jobs', name+'.json')
+        with open(job, 'w') as outfile:
+            json.dump(job_json, outfile)
+        jobs += [job]
+    return jobs
+
+
+def submit_jobs(jobs, jobdir, client=None):
     """
     Give list of jobs to submit, submits them to AWS Batch
     """
-    cmd_template = 'aws batch submit-job --cli-input-json file://{}'
+    if client is None:
+        client = boto3.client('batch')
 
     for job in jobs:
-        cmd = cmd_template.format(job)
+        with open(job, 'r') as inf:
+            job_json = json.load(inf)
         print("... Submitting job {}...".format(job))
-        out, err = mgu.execute_cmd(cmd)
-        submission = ast.literal_eval(out)
+        submission = client.submit_job(**job_json)
+        submission.pop('ResponseMetadata', None)
         print("Job Name: {}, Job ID: {}".format(submission['jobName'],
                                                 submission['jobId']))
         sub_file = os.path.join(jobdir, 'ids', submission['jobName']+'.json')
@@ -202,60 +386,135 @@ def submit_jobs(jobs, jobdir):
     return 0
 
 
-def get_status(jobdir, jobid=None):
+def load_submissions(jobdir):
+    """
+    Reads the submission records written by `submit_jobs`, keyed by job ID.
+    """
+    submissions = OrderedDict()
+    for job in sorted(os.listdir(jobdir+'/ids/')):
+        with open('{}/ids/{}'.format(jobdir, job), 'r') as inf:
+            submission = json.load(inf)
+        submissions[submission['jobId']] = submission
+    return submissions
+
+
+def describe_jobs(jobids, client=None):
+    """
+    Queries AWS Batch for the state of the given jobs, 100 IDs (the API
+    maximum) per request, and returns a dictionary of job ID to description.
+    """
+    if client is None:
+        client = boto3.client('batch')
+    jobids = list(jobids)
+    desc = OrderedDict()
+    for start in range(0, len(jobids), 100):
+        resp = client.describe_jobs(jobs=jobids[start:start + 100])
+        for job in resp['jobs']:
+            desc[job['jobId']] = job
+    return desc
+
+
+def refresh_status(jobdir, client=None):
     """
-    Given list of jobs, returns status of each.
+    Updates the local cache of job states in `<jobdir>/status.json`, only
+    asking AWS about jobs which had not yet finished, and returns it.
     """
-    cmd_template = 'aws batch describe-jobs --jobs {}'
+    cache_file = os.path.join(jobdir, 'status.json')
+    cache = dict()
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'r') as inf:
+            cache = json.load(inf)
+
+    submissions = load_submissions(jobdir)
+    todo = [jid for jid in submissions
+            if cache.get(jid, {}).get('status') not in done_states]
+    for jid, job in describe_jobs(todo, client).items():
+        cache[jid] = {'jobName': job['jobName'], 'status': job['status']}
+        summary = job.get('arrayProperties', {}).get('statusSummary')
+        if summary:
+            cache[jid]['statusSummary'] = summary
+
+    with open(cache_file, 'w') as outfile:
+        json.dump(cache, outfile)
+    return OrderedDict((jid, cache[jid]) for jid in submissions
+                       if jid in cache)
+
+
+def show_status(states):
+    """
+    Prints a histogram of job states, counting array children individually.
+    """
+    hist = Counter()
+    for state in states.values():
+        if state.get('statusSummary'):
+            hist.update(state['statusSummary'])
+        else:
+            hist[state['status']] += 1
+    width = max([len(k) for k in hist.keys()] + [0])
+    for status in all_states + sorted(set(hist.keys()) - set(all_states)):
+        if hist[status]:
+            print("... {}: {}".format(status.ljust(width), hist[status]))
+    return hist
 
+
+def get_status(jobdir, jobid=None, client=None, watch=None):
+    """
+    Given list of jobs, returns status of each. With `watch` (seconds), keeps
+    refreshing the unfinished jobs until all have completed.
+    """
     if jobid is None:
         print("Describing jobs in {}/ids/...".format(jobdir))
-        jobs = os.listdir(jobdir+'/ids/')
-        for job in jobs:
-            with open('{}/ids/{}'.format(jobdir, job), 'r') as inf:
-                submission = json.load(inf)
-            cmd = cmd_template.format(submission['jobId'])
-            print("... Checking job {}...".format(submission['jobName']))
-            out, err = mgu.execute_cmd(cmd)
-            status = re.findall('"status": "([A-Za-z]+)",', out)[0]
-            print("... ... Status: {}".format(status))
-        return 0
+        while True:
+            states = refresh_status(jobdir, client)
+            for state in states.values():
+                if state['status'] not in done_states:
+                    print("... {}: {}".format(state['jobName'],
+                                              state['status']))
+            print("Status summary ({} jobs):".format(len(states)))
+            show_status(states)
+            if watch is None or all(state['status'] in done_states
+                                    for state in states.values()):
+                return 0
+            time.sleep(watch)
     else:
         print("Describing job id {}...".format(jobid))
-        cmd = cmd_template.format(jobid)
-        out, err = mgu.execute_cmd(cmd)
-        status = re.findall('"status": "([A-Za-z]+)",', out)[0]
+        status = describe_jobs([jobid], client)[jobid]['status']
         print("... Status: {}".format(status))
         return status
 
 
-def kill_jobs(jobdir, reason='"Killing job"'):
+def kill_jobs(jobdir, reason='Killing job', client=None, workers=16):
     """
     Given a list of jobs, kills them all.
     """
-    cmd_template1 = 'aws batch cancel-job --job-id {} --reason {}'
-    cmd_template2 = 'aws batch terminate-job --job-id {} --reason {}'
+    if client is None:
+        client = boto3.client('batch')
 
     print("Canelling/Terminating jobs in {}/ids/...".format(jobdir))
-    jobs = os.listdir(jobdir+'/ids/')
-    for job in jobs:
-        with open('{}/ids/{}'.format(jobdir, job), 'r') as inf:
-            submission = json.load(inf)
-        jid = submission['jobId']
-        name = submission['jobName']
-        status = get_status(jobdir, jid)
-        if status in ['SUCCEEDED', 'FAILED']:
-            print("... No action needed for {}...".format(name))
+    states = refresh_status(jobdir, client)
+
+    def kill(item):
+        jid, state = item
+        name, status = state['jobName'], state['status']
+        if status in done_states:
+            return "... No action needed for {}...".format(name)
         elif status in ['SUBMITTED', 'PENDING', 'RUNNABLE']:
-            cmd = cmd_template1.format(jid, reason)
-            print("... Cancelling job {}...".format(name))
-            out, err = mgu.execute_cmd(cmd)
+            client.cancel_job(jobId=jid, reason=reason)
+            return "... Cancelled job {}...".format(name)
         elif status in ['STARTING', 'RUNNING']:
-            cmd = cmd_template2.format(jid, reason)
-            print("... Terminating job {}...".format(name))
-            out, err = mgu.execute_cmd(cmd)
+            client.terminate_job(jobId=jid, reason=reason)
+            return "... Terminated job {}...".format(name)
         else:
-            print("... Unknown status??")
+            return "... Unknown status of {}: {}".format(name, status)
+
+    pool = ThreadPool(max(1, min(workers, len(states))))
+    try:
+        # Logged here rather than from the threads, so lines don't interleave
+        for line in pool.map(kill, list(states.items())):
+            print(line)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def main():
@@ -284,6 +543,25 @@ def main():
                         'temp files along the path of processing.',
                         default=False)
     parser.add_argument('--dataset', action='store', help='Dataset name')
+    parser.add_argument('--watch', action='store', nargs='?', type=int,
+                        const=60, help='keep refreshing job status every '
+                        'WATCH seconds (default 60) until all jobs finish.')
+    parser.add_argument('--array', action='store_true', help='flag to submit '
+                        'all sessions as a single AWS Batch array job.',
+                        default=False)
+    parser.add_argument('--pack', action='store', type=float, help='pack '
+                        'sessions into array children of up to PACK hours '
+                        'of estimated runtime (implies --array).')
+    parser.add_argument('--job_overhead', action='store', type=float,
+                        default=job_overhead, help='estimated fixed runtime '
+                        'of each job in seconds, used by --pack (default: '
+                        '%(default)s).')
+    parser.add_argument('--sec_per_mb', action='store', type=float,
+                        default=sec_per_mb, help='estimated runtime in '
+                        'seconds per MB of session input, used by --pack '
+                        '(default: %(default)s).')
+    parser.add_argument('--skip', action='store', nargs='+',
+                        help='Parcellations to leave out of group analysis.')
     result = parser.parse_args()
 
     bucket = result.bucket
@@ -295,6 +573,12 @@ def main():
     jobdir = result.jobdir
     dset = result.dataset
     log = result.log
+    array = result.array
+    watch = result.watch
+    pack = result.pack
+    overhead = result.job_overhead
+    rate = result.sec_per_mb
+    skip = result.skip
 
     if jobdir is None:
         jobdir = './'
@@ -306,13 +590,14 @@ def main():
 
     if state == 'status':
         print("Checking job status...")
-        get_status(jobdir)
+        get_status(jobdir, watch=watch)
     elif state == 'kill':
         print("Killing jobs...")
         kill_jobs(jobdir)
     elif state == 'group' or state == 'session':
         print("Beginning batch submission process...")
-        batch_submit(bucket, path, jobdir, creds, state, debug, dset, log)
+        batch_submit(bucket, path, jobdir, creds, state, debug, dset, log,
+                     array, pack, overhead, rate, skip)
 
     sys.exit(0)
 
@@ -24,9 +24,17 @@ from __future__ import print_function
 from argparse import ArgumentParser
 from datetime import datetime
 from subprocess import Popen, PIPE
+from multiprocessing import Process, Queue
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 from ndmg.stats.qa_reg import *
 from ndmg.stats.qa_tensor import *
 from ndmg.stats.qa_fibers import *
+from ndmg.track.tensor_store import save_tensors
+from ndmg.track.fiber_store import save_fibers
+from ndmg.graph.label_cache import load_labels
 import ndmg.utils as mgu
 import ndmg.register as mgr
 import ndmg.track as mgt
@@ -35,6 +43,69 @@ import ndmg.preproc as mgp
 import numpy as np
 import nibabel as nb
 import os
+import time
+
+max_qa = 2  # QA stages rendering at once in the background
+
+
+def _run_qa(name, func, args, results):
+    """
+    Runs one QA stage, reporting its duration and whether it succeeded.
+    """
+    start = time.time()
+    try:
+        func(*args)
+        ok = True
+    except Exception as e:
+        print("{} QA failed: {}".format(name, e))
+        ok = False
+    results.put((name, time.time() - start, ok))
+
+
+def submit_qa(jobs, results, name, func, *args):
+    """
+    Starts a QA stage in a background process, so that the pipeline carries
+    on while it renders. At most max_qa stages run at once; beyond that the
+    oldest one running is waited for first.
+    """
+    running = [job for job in jobs if job.is_alive()]
+    if len(running) >= max_qa:
+        running[0].join()
+    job = Process(target=_run_qa, args=(name, func, args, results))
+    job.start()
+    jobs.append(job)
+
+
+def join_qa(jobs, results):
+    """
+    Waits for all QA stages and reports their timings: how long each ran in
+    the background, and how long the pipeline itself had to wait for them.
+    A stage which crashed its process is reported as failed.
+    """
+    start = time.time()
+    # Results are read before joining: a process does not exit until what
+    # it put on the queue has been consumed
+    done = dict()
+    while len(done) < len(jobs):
+        alive = any(job.is_alive() for job in jobs)
+        try:
+            name, took, ok = results.get(timeout=1)
+        except Empty:
+            if alive:
+                continue
+            break  # the remaining stages crashed without reporting
+        done[name] = (took, ok)
+    for job in jobs:
+        job.join()
+    wait = time.time() - start
+    print("QA stages (run in the background):")
+    for name in sorted(done):
+        took, ok = done[name]
+        print("  {}: {:.1f}s{}".format(name, took, "" if ok else " (failed)"))
+    crashed = len([job for job in jobs if job.exitcode != 0])
+    if crashed:
+        print("  {} QA stage(s) crashed".format(crashed))
+    print("Waited {:.1f}s for QA after the pipeline finished".format(wait))
 
 
 def ndmg_dwi_pipeline(dwi, bvals, bvecs, mprage, atlas, mask, labels, outdir,
@@ -43,6 +114,8 @@ def ndmg_dwi_pipeline(dwi, bvals, bvecs, mprage, atlas, mask, labels, outdir,
     Creates a brain graph from MRI data
     """
     startTime = datetime.now()
+    qa_jobs = []
+    qa_results = Queue()
 
     # Create derivative output directories
     dwi_name = mgu.get_filename(dwi)
@@ -86,36 +159,37 @@ def ndmg_dwi_pipeline(dwi, bvals, bvecs, mprage, atlas, mask, labels, outdir,
     print("Aligning volumes...")
     mgr().dwi2atlas(dwi1, gtab, mprage, atlas, aligned_dwi, outdir, clean)
     loc0 = np.where(gtab.b0s_mask)[0][0]
-    reg_mri_pngs(aligned_dwi, atlas, "{}/qa/reg/dwi/".format(outdir), loc=loc0)
+    submit_qa(qa_jobs, qa_results, "Registration", reg_mri_pngs, aligned_dwi,
+              atlas, "{}/qa/reg/dwi/".format(outdir), loc0)
 
     print("Beginning tractography...")
     # Compute tensors and track fiber streamlines
     tens, tracks = mgt().eudx_basic(aligned_dwi, mask, gtab, stop_val=0.2)
-    tensor2fa(tens, tensors, aligned_dwi, "{}/tensors/".format(outdir),
+    submit_qa(qa_jobs, qa_results, "Tensor", tensor2fa, tens, tensors,
+              aligned_dwi, "{}/tensors/".format(outdir),
               "{}/qa/tensors/".format(outdir))
 
     # As we've only tested VTK plotting on MNI152 aligned data...
-    if nb.load(mask).get_data().shape == (182, 218, 182):
-        try:
-            visualize_fibs(tracks, fibers, mask,
-                           "{}/qa/fibers/".format(outdir), 0.02)
-        except:
-            print("Fiber QA failed - VTK for Python not configured properly.")
+    if nb.load(mask).shape == (182, 218, 182):
+        submit_qa(qa_jobs, qa_results, "Fiber", visualize_fibs, tracks, fibers,
+                  mask, "{}/qa/fibers/".format(outdir), 0.02)
 
     # And save them to disk
-    np.savez(tensors, tens)
-    np.savez(fibers, tracks)
+    save_tensors(tensors, tens, nb.load(mask).get_data(),
+                 nb.load(aligned_dwi).affine)
+    save_fibers(fibers, tracks)
 
     # Generate graphs from streamlines for each parcellation
     for idx, label in enumerate(label_name):
         print("Generating graph for {} parcellation...".format(label))
 
-        labels_im = nb.load(labels[idx])
-        g1 = mgg(len(np.unique(labels_im.get_data()))-1, labels[idx])
+        g1 = mgg(len(load_labels(labels[idx]).ids), labels[idx])
         g1.make_graph(tracks)
         g1.summary()
         g1.save_graph(graphs[idx], fmt=fmt)
 
+    print("Pipeline took: {}".format(datetime.now() - startTime))
+    join_qa(qa_jobs, qa_results)
     print("Execution took: {}".format(datetime.now() - startTime))
 
     # Clean temp files
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# centrality.py
+
+from __future__ import print_function, division
+
+from collections import OrderedDict, deque
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import time
+
+min_pivots = 50  # fewest source nodes used by the sampled estimator
+pilot_sources = 10  # sources timed to decide between exact and sampled
+
+
+def adjacency_lists(g):
+    """
+    Neighbour index lists of a graph in its own node order, without
+    self-loops (which never lie on shortest paths).
+    """
+    nodes = g.nodes()
+    pos = dict((n, i) for i, n in enumerate(nodes))
+    return [[pos[m] for m in g.neighbors(n) if m != n] for n in nodes]
+
+
+def _brandes(args):
+    """
+    Accumulates Brandes' pair dependencies of every node from the given
+    source nodes (unweighted shortest paths). Returns their sum and sum of
+    squares over sources, the latter for error estimates when sampling.
+    """
+    adj, sources = args
+    n = len(adj)
+    total = np.zeros(n)
+    sq = np.zeros(n)
+    for s in sources:
+        S = []
+        P = [[] for _ in range(n)]
+        sigma = [0] * n
+        sigma[s] = 1
+        D = [-1] * n
+        D[s] = 0
+        Q = deque([s])
+        while Q:
+            v = Q.popleft()
+            S.append(v)
+            for w in adj[v]:
+                if D[w] < 0:
+                    D[w] = D[v] + 1
+                    Q.append(w)
+                if D[w] == D[v] + 1:
+                    sigma[w] += sigma[v]
+                    P[w].append(v)
+        delta = [0.0] * n
+        while S:
+            w = S.pop()
+            coeff = (1.0 + delta[w]) / sigma[w]
+            for v in P[w]:
+                delta[v] += sigma[v] * coeff
+        delta[s] = 0.0
+        delta = np.array(delta)
+        total += delta
+        sq += delta * delta
+    return total, sq
+
+
+def betweenness(adj, sources, pool=None, nproc=1):
+    """
+    Normalized betweenness centrality of every node, from all sources (exact)
+    or from a sample of pivot sources, with the standard error of the sampled
+    estimate (zero when exact).
+
+    Required parameters:
+        adj:
+            - Neighbour lists, as returned by adjacency_lists
+        sources:
+            - Source node indices to accumulate from
+    Optional parameters:
+        pool:
+            - multiprocessing Pool the sources are spread across
+        nproc:
+            - Number of chunks to split the sources into
+    """
+    n = len(adj)
+    k = len(sources)
+    chunks = [(adj, list(c)) for c in np.array_split(sources, nproc)
+              if len(c) > 0]
+    if pool is None:
+        parts = [_brandes(c) for c in chunks]
+    else:
+        parts = pool.map(_brandes, chunks)
+    total = np.sum([p[0] for p in parts], axis=0)
+    sq = np.sum([p[1] for p in parts], axis=0)
+
+    # Same scaling as networkx: ordered pairs, excluding the node itself
+    scale = 1.0 / ((n - 1) * (n - 2)) if n > 2 else 1.0
+    if k >= n:
+        return total * scale, np.zeros(n)
+    mean = total / k
+    var = np.maximum(sq / k - mean**2, 0) * k / max(k - 1, 1)
+    fpc = (n - k) / (n - 1.0)  # sampling without replacement
+    err = np.sqrt(var / k * fpc) * n * scale
+    return mean * n * scale, err
+
+
+def betweenness_centralities(graphs, budget=None, k=None, seed=12345,
+                             nproc=None):
+    """
+    Computes betweenness centrality for a set of graphs, spreading source
+    nodes across a process pool. If `k` is given, `k` pivot sources sampled
+    with a fixed seed are used for each graph. Otherwise, if a time `budget`
+    (seconds for the whole set) is given, a few sources are timed and exact
+    computation is used if it fits in the budget, or else the largest number
+    of pivots which does.
+
+    Required parameters:
+        graphs:
+            - Dictionary of graphs
+    Optional parameters:
+        budget:
+            - Time budget in seconds for choosing exact or sampled mode
+        k:
+            - Number of pivot sources per graph
+        seed:
+            - Seed of the pivot sampling
+        nproc:
+            - Number of worker processes (defaults to the number of CPUs)
+    """
+    if nproc is None:
+        nproc = cpu_count()
+    adjs = OrderedDict((subj, adjacency_lists(graphs[subj]))
+                       for subj in graphs)
+
+    if k is None and budget is not None and len(adjs) > 0:
+        adj = list(adjs.values())[0]
+        pilot = range(min(pilot_sources, len(adj)))
+        start = time.time()
+        _brandes((adj, pilot))
+        per_source = (time.time() - start) / max(len(pilot), 1)
+        sources = sum(len(a) for a in adjs.values())
+        exact = per_source * sources / nproc
+        if exact > budget:
+            k = int(budget * nproc / (per_source * len(adjs)))
+            k = max(k, min_pivots)
+            print("Exact betweenness would take ~{:.0f}s; sampling {} "
+                  "pivots per graph.".format(exact, k))
+
+    pool = Pool(nproc) if nproc > 1 else None
+    bc = OrderedDict()
+    errs = OrderedDict()
+    try:
+        for subj, adj in adjs.items():
+            n = len(adj)
+            if k is None or k >= n:
+                sources = np.arange(n)
+            else:
+                rng = np.random.RandomState(seed)
+                sources = np.sort(rng.choice(n, k, replace=False))
+            bc[subj], errs[subj] = betweenness(adj, sources, pool, nproc)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if k is not None:
+        print("Max standard error of sampled betweenness: " +
+              ", ".join(["%.2e" % np.max(errs[key]) for key in errs.keys()]))
+    return bc, errs
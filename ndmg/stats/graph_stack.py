@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# graph_stack.py
+
+import numpy as np
+import scipy.sparse as sp
+
+# Largest node count for which subjects are stacked into dense N x N arrays;
+# bigger graphs are handled one at a time as sparse matrices (sparse_metrics)
+dense_max_nodes = 2000
+# Bytes per cell of a stack: float64 weights and boolean edge presence
+stack_cell_bytes = 9
+
+
+def node_order(graphs):
+    """
+    Returns the union of the nodes of all graphs, sorted numerically where
+    the node labels allow it. This is the node axis of the stacked arrays.
+
+    Required parameters:
+        graphs:
+            - Dictionary of networkx graphs
+    """
+    nodes = set()
+    for g in graphs.values():
+        nodes.update(g.nodes())
+    return sort_nodes(nodes)
+
+
+def sort_nodes(nodes):
+    """
+    Sorts node labels, numerically where the labels allow it.
+    """
+    def key(n):
+        try:
+            return (0, float(n), '')
+        except (TypeError, ValueError):
+            return (1, 0, str(n))
+    return sorted(nodes, key=key)
+
+
+def stack_graphs(graphs, subjs, nodes):
+    """
+    Loads the given subjects into stacked (subjects x N x N) arrays of edge
+    weights (float) and of edge presence (bool), aligned to a common node
+    order.
+
+    Required parameters:
+        graphs:
+            - Dictionary of networkx graphs
+        subjs:
+            - List of keys in graphs to stack
+        nodes:
+            - Node order of the stack, as returned by node_order
+    """
+    pos = dict((n, i) for i, n in enumerate(nodes))
+    N = len(nodes)
+    A = np.zeros((len(subjs), N, N))
+    E = np.zeros((len(subjs), N, N), dtype=bool)
+    for s, subj in enumerate(subjs):
+        edges = list(graphs[subj].edges(data=True))
+        if len(edges) == 0:
+            continue
+        u = np.array([pos[e[0]] for e in edges])
+        v = np.array([pos[e[1]] for e in edges])
+        w = np.array([e[2]['weight'] for e in edges], dtype=float)
+        A[s, u, v] = A[s, v, u] = w
+        E[s, u, v] = E[s, v, u] = True
+    return A, E
+
+
+def iter_stacks(graphs, nodes, max_bytes=2**29):
+    """
+    Yields (subjects, A, E) stacks over all graphs, taking as many subjects
+    at once as fit in `max_bytes` so that memory does not grow with the size
+    of the study. At least one subject is always taken, so a single stack
+    needs `stack_cell_bytes * N**2` bytes whatever `max_bytes` is.
+    """
+    subjs = list(graphs.keys())
+    chunk = stack_subjects(len(nodes), max_bytes)
+    for start in range(0, len(subjs), chunk):
+        batch = subjs[start:start + chunk]
+        A, E = stack_graphs(graphs, batch, nodes)
+        yield batch, A, E
+
+
+def stack_subjects(N, max_bytes=2**29):
+    """
+    Number of subjects of N nodes that iter_stacks takes at once.
+    """
+    return max(1, int(max_bytes // (stack_cell_bytes * N**2 or 1)))
+
+
+def subject_index(g, nodes):
+    """
+    Positions of a graph's own nodes (in its node order) on the stack axis,
+    used to pull per-subject vectors back out of the stacked results.
+    """
+    pos = dict((n, i) for i, n in enumerate(nodes))
+    return np.array([pos[n] for n in g.nodes()], dtype=int)
+
+
+def number_non_zeros(E):
+    """
+    Number of edges (self-loops included) of each stacked graph.
+    """
+    diag = np.diagonal(E, axis1=1, axis2=2).sum(axis=1)
+    return (E.sum(axis=(1, 2)) - diag) // 2 + diag
+
+
+def degrees(E):
+    """
+    Degree of each node of each stacked graph; self-loops count twice, as in
+    networkx.
+    """
+    return E.sum(axis=2) + np.diagonal(E, axis1=1, axis2=2)
+
+
+def hemisphere_degrees(E, halves):
+    """
+    Splits the degrees of each stacked graph into ipsilateral (neighbours in
+    the same hemisphere) and contralateral counts.
+
+    Required parameters:
+        E:
+            - Stacked (subjects x N x N) edge presence
+        halves:
+            - (subjects x N) array; 1 for nodes in the second hemisphere
+    """
+    diag = np.diagonal(E, axis1=1, axis2=2)
+    total = E.sum(axis=2)
+    second = np.einsum('sij,sj->si', E, halves)
+    ipso = np.where(halves > 0, second, total - second) + diag
+    contra = total + diag - ipso
+    return ipso, contra
+
+
+def clustering(E):
+    """
+    Unweighted clustering coefficient of each node of each stacked graph,
+    ignoring self-loops as networkx does.
+    """
+    # float32 counts are exact up to 2**24, far above dense_max_nodes**2
+    B = E.astype(np.float32)
+    idx = np.arange(B.shape[1])
+    B[:, idx, idx] = 0
+    tri = (np.matmul(B, B) * B).sum(axis=2)
+    deg = B.sum(axis=2)
+    denom = deg * (deg - 1)
+    cc = np.zeros(deg.shape)
+    np.divide(tri, denom, out=cc, where=denom > 0)
+    return cc
+
+
+def edge_weights(A, E, s, idx):
+    """
+    Weights of the edges of one stacked graph, over its own nodes.
+    """
+    sub = np.ix_(idx, idx)
+    a = A[s][sub]
+    e = E[s][sub]
+    iu = np.triu_indices(len(idx))
+    return a[iu][e[iu] > 0]
+
+
+def sparse_adjacency(g, nodes=None):
+    """
+    Symmetric sparse (CSR) weighted adjacency of a graph, over `nodes` or the
+    graph's own node order.
+    """
+    if nodes is None:
+        nodes = g.nodes()
+    pos = dict((n, i) for i, n in enumerate(nodes))
+    edges = list(g.edges(data=True))
+    u = np.array([pos[e[0]] for e in edges], dtype=int)
+    v = np.array([pos[e[1]] for e in edges], dtype=int)
+    w = np.array([e[2]['weight'] for e in edges], dtype=float)
+    off = u != v  # self-loops are stored once, on the diagonal
+    rows = np.concatenate((u, v[off]))
+    cols = np.concatenate((v, u[off]))
+    vals = np.concatenate((w, w[off]))
+    N = len(nodes)
+    return sp.csr_matrix((vals, (rows, cols)), shape=(N, N))
+
+
+def sparse_metrics(g):
+    """
+    The stacked metrics of a single graph (number of edges, degrees,
+    ipsilateral and contralateral degrees, edge weights and clustering
+    coefficients) over its own node order, computed on sparse matrices so
+    that memory grows with the number of edges rather than nodes squared.
+    """
+    W = sparse_adjacency(g)
+    W.sort_indices()
+    P = W.copy()
+    P.data = np.ones(len(P.data), dtype=int)
+    N = W.shape[0]
+    diag = P.diagonal()
+    total = np.asarray(P.sum(axis=1)).ravel()
+    nnz = int((P.nnz - diag.sum()) // 2 + diag.sum())
+
+    # Hemispheres are taken as the first and second half of the node order
+    halves = np.zeros(N, dtype=int)
+    halves[N//2:] = 1
+    second = P.dot(halves)
+    ipso = np.where(halves > 0, second, total - second) + diag
+    contra = total + diag - ipso
+
+    B = P - sp.diags(diag, format='csr')
+    B.eliminate_zeros()
+    tri = np.asarray(B.dot(B).multiply(B).sum(axis=1)).ravel()
+    deg = np.asarray(B.sum(axis=1)).ravel()
+    denom = deg * (deg - 1)
+    cc = np.zeros(N)
+    np.divide(tri, denom.astype(float), out=cc, where=denom > 0)
+
+    ew = sp.triu(W, format='csr')
+    ew.sort_indices()
+    return nnz, total + diag, ipso, contra, ew.data, cc
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# kde.py
+
+from __future__ import division
+
+import numpy as np
+from scipy.stats import gaussian_kde
+
+grid_max = 2**21  # most grid points of a binned density
+grid_per_bw = 20  # grid points per bandwidth
+kernel_bws = 8  # kernels are cut off this many bandwidths from their centre
+grid_constant = 2**14  # grid points of samples with a zero bandwidth
+chunk_size = 2**24  # most FFT coefficients held at once
+
+
+def scott_bandwidth(x):
+    """
+    Gaussian kernel bandwidth of scipy.stats.gaussian_kde with its default
+    (Scott's) rule: the sample standard deviation times n^(-1/5).
+    """
+    n = len(x)
+    if n < 2:
+        return 0.0
+    return np.std(x, ddof=1) * n**(-0.2)
+
+
+def binned_kde(data, points):
+    """
+    Gaussian kernel density estimates of several samples, with Scott's
+    bandwidth as in scipy.stats.gaussian_kde.
+
+    Each sample is linearly binned onto its own regular grid, spaced a
+    twentieth of its bandwidth, and convolved with its kernel by FFT, with
+    samples whose grids need the same FFT length transformed together; each
+    density is then interpolated at its evaluation points. This costs
+    O(n + G log G) per sample for a grid of G points, instead of
+    O(n * len(points)). At that resolution the result is within 1e-3 of
+    gaussian_kde, relative to the peak of the density. Kernels are truncated
+    kernel_bws bandwidths out, where they are below 1e-13 of their peak.
+
+    Only samples whose grid would need more than grid_max points (a range
+    over 10^5 bandwidths) are evaluated exactly with gaussian_kde instead.
+    Samples with a zero bandwidth (one value, or all values equal) get a
+    kernel one grid step wide rather than failing.
+
+    Required parameters:
+        data:
+            - List of 1-d sample arrays
+        points:
+            - List of arrays of points to evaluate each density at
+    """
+    data = [np.ravel(np.asarray(d, dtype=float)) for d in data]
+    points = [np.ravel(np.asarray(p, dtype=float)) for p in points]
+    dens = [None] * len(data)
+    grids = dict()
+    for s, (d, p) in enumerate(zip(data, points)):
+        bw = scott_bandwidth(d)
+        lo = min(np.min(d), np.min(p))
+        span = max(max(np.max(d), np.max(p)) - lo, np.finfo(float).tiny)
+        if bw > 0:
+            step = bw / grid_per_bw
+            if span / step >= grid_max:
+                dens[s] = gaussian_kde(d)(p)
+                continue
+        else:
+            step = bw = span / (grid_constant - 1)
+        G = int(np.ceil(span / step)) + 1
+        K = min(G - 1, int(np.ceil(kernel_bws * bw / step)))
+        L = 1 << int(np.ceil(np.log2(G + 2 * K)))
+        grids.setdefault(L, []).append((s, lo, step, bw, G, K))
+
+    for L, subjs in grids.items():
+        # Grids sharing an FFT length are padded to the longest of them
+        G = max(g[4] for g in subjs)
+        K = max(g[5] for g in subjs)
+        per_chunk = max(1, chunk_size // L)
+        for start in range(0, len(subjs), per_chunk):
+            chunk = subjs[start:start + per_chunk]
+            counts = np.zeros((len(chunk), G))
+            kernels = np.zeros((len(chunk), 2 * K + 1))
+            for c, (s, lo, step, bw, _, _) in enumerate(chunk):
+                # Linear binning: each value is split between its two
+                # nearest grid points
+                pos = (data[s] - lo) / step
+                idx = np.clip(np.floor(pos).astype(int), 0, G - 2)
+                frac = pos - idx
+                counts[c] = (np.bincount(idx, 1 - frac, minlength=G) +
+                             np.bincount(idx + 1, frac, minlength=G)) / \
+                    len(data[s])
+                # Linear (not circular) convolution over offsets -K..K
+                offsets = step * np.arange(-K, K + 1)
+                kernels[c] = np.exp(-0.5 * (offsets / bw)**2) / \
+                    (bw * np.sqrt(2 * np.pi))
+            conv = np.fft.irfft(np.fft.rfft(counts, L) *
+                                np.fft.rfft(kernels, L), L)
+            for c, (s, lo, step, bw, _, _) in enumerate(chunk):
+                grid = lo + step * np.arange(G)
+                f = np.maximum(conv[c, K:K + G], 0)
+                dens[s] = np.interp(points[s], grid, f)
+    return dens
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# metric_io.py
+
+from collections import OrderedDict
+
+import numpy as np
+import json
+import os
+import os.path as op
+
+# Layout of a stored metric, one directory per metric:
+#   meta.json                 - metric name, subject index and field kinds
+#   <field>.values.npy        - per-subject vectors concatenated (ragged), or
+#                               the per-subject scalars, or a study matrix
+#   <field>.offsets.npy       - start of each subject's vector in values
+# Metrics with several per-subject fields (e.g. the degree distribution)
+# store one values/offsets pair per field.
+
+
+def is_metric(path):
+    """
+    Whether a path is a metric directory written by write_metric.
+    """
+    return op.isfile(op.join(path, 'meta.json'))
+
+
+def write_metric(path, metric, data):
+    """
+    Writes a metric to a columnar directory of uncompressed .npy arrays.
+
+    Required parameters:
+        path:
+            - Directory to write the metric to
+        metric:
+            - Name of the metric
+        data:
+            - Dictionary of subject to vector or scalar, a dictionary of
+              such dictionaries (one per field), or a single study-wide array
+    """
+    if not op.isdir(path):
+        os.makedirs(path)
+    if isinstance(data, dict):
+        nested = all(isinstance(v, dict) for v in data.values()) and \
+            len(data) > 0
+        fields = data if nested else {metric: data}
+    else:
+        nested = False
+        fields = {metric: data}
+
+    meta = {'metric': metric, 'nested': nested, 'subjects': [],
+            'fields': {}}
+    for field, values in fields.items():
+        if not isinstance(values, dict):
+            np.save(op.join(path, field + '.values.npy'), np.asarray(values))
+            meta['fields'][field] = 'matrix'
+            continue
+        subjs = list(values.keys())
+        meta['subjects'] = subjs
+        vecs = [np.ravel(values[subj]) for subj in subjs]
+        scalar = all(np.ndim(values[subj]) == 0 for subj in subjs)
+        lengths = [len(v) for v in vecs]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        flat = np.concatenate(vecs) if len(vecs) > 0 else np.zeros(0)
+        np.save(op.join(path, field + '.values.npy'), flat)
+        np.save(op.join(path, field + '.offsets.npy'), offsets)
+        meta['fields'][field] = 'scalar' if scalar else 'ragged'
+    with open(op.join(path, 'meta.json'), 'w') as of:
+        json.dump(meta, of)
+
+
+def read_metric(path, mmap_mode='r', subjects=None):
+    """
+    Reads a metric written by write_metric into the in-memory layout the
+    plotting code uses, i.e. {metric: data} with data as originally written.
+    Arrays are memory-mapped by default, so that only the slices which are
+    used get read from disk.
+
+    Required parameters:
+        path:
+            - Metric directory
+    Optional parameters:
+        mmap_mode:
+            - Passed on to numpy.load; None reads everything into memory
+        subjects:
+            - Subset of subjects to return (all by default)
+    """
+    with open(op.join(path, 'meta.json'), 'r') as inf:
+        meta = json.load(inf)
+    subjs = meta['subjects']
+    if subjects is None:
+        subjects = subjs
+    rows = dict((s, i) for i, s in enumerate(subjs))
+
+    data = dict()
+    for field, kind in meta['fields'].items():
+        values = np.load(op.join(path, field + '.values.npy'),
+                         mmap_mode=mmap_mode)
+        if kind == 'matrix':
+            data[field] = values
+            continue
+        offsets = np.load(op.join(path, field + '.offsets.npy'))
+        out = OrderedDict()
+        for subj in subjects:
+            i = rows[subj]
+            if kind == 'scalar':
+                out[subj] = values[offsets[i]].item()
+            else:
+                out[subj] = values[offsets[i]:offsets[i+1]]
+        data[field] = out
+    if not meta['nested']:
+        data = data[meta['metric']]
+    return {meta['metric']: data}
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# metric_store.py
+
+from ndmg.stats.graph_stack import sort_nodes
+
+import numpy as np
+import hashlib
+import pickle
+import os
+import os.path as op
+
+
+def file_hash(path, blocksize=2**20):
+    """
+    SHA-1 of the contents of a file.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as inf:
+        for block in iter(lambda: inf.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_index(storedir):
+    """
+    Loads the index of a metric store: the content hash of each stored graph,
+    the parameters its metrics were computed with, and the running mean and
+    sum of squared deviations (Welford) of their adjacency matrices, with
+    the number of graphs having each edge. An empty index is returned for a
+    new store, or for one written before these were kept (so that it gets
+    rebuilt).
+    """
+    fname = op.join(storedir, 'index.pkl')
+    if op.isfile(fname):
+        with open(fname, 'rb') as inf:
+            index = pickle.load(inf)
+        if 'nnz' in index:
+            return index
+    return {'graphs': dict(), 'nodes': [], 'mean': np.zeros((0, 0)),
+            'm2': np.zeros((0, 0)), 'nnz': np.zeros((0, 0), dtype=np.int32),
+            'count': 0}
+
+
+def save_index(storedir, index):
+    if not op.isdir(storedir):
+        os.makedirs(storedir)
+    with open(op.join(storedir, 'index.pkl'), 'wb') as of:
+        pickle.dump(index, of)
+
+
+def record_path(storedir, subj):
+    return op.join(storedir, subj + '.pkl')
+
+
+def load_record(storedir, subj):
+    """
+    Loads the stored results of one graph: its content hash, per-subject
+    metrics, node labels and sparse adjacency.
+    """
+    with open(record_path(storedir, subj), 'rb') as inf:
+        return pickle.load(inf)
+
+
+def save_record(storedir, subj, record):
+    if not op.isdir(storedir):
+        os.makedirs(storedir)
+    with open(record_path(storedir, subj), 'wb') as of:
+        pickle.dump(record, of)
+
+
+def remove_record(storedir, subj):
+    os.remove(record_path(storedir, subj))
+
+
+def update_moments(index, nodes, adj, sign=1):
+    """
+    Adds (sign=1) or removes (sign=-1) one graph's sparse adjacency to the
+    running mean and sum of squared deviations kept in the index (Welford's
+    algorithm), growing their node axis if the graph has nodes not seen
+    before. Memory is that of three dense matrices whatever the number of
+    graphs.
+
+    Removal leaves rounding residues, which the square root of the variance
+    would magnify; edges no remaining graph has are therefore reset to
+    exactly zero, using the per-edge graph counts.
+    """
+    if set(nodes) - set(index['nodes']):
+        union = sort_nodes(set(index['nodes']) | set(nodes))
+        pos = dict((n, i) for i, n in enumerate(union))
+        old = np.array([pos[n] for n in index['nodes']], dtype=int)
+        for key in ['mean', 'm2', 'nnz']:
+            grown = np.zeros((len(union), len(union)),
+                             dtype=index[key].dtype)
+            grown[np.ix_(old, old)] = index[key]
+            index[key] = grown
+        index['nodes'] = union
+    pos = dict((n, i) for i, n in enumerate(index['nodes']))
+    idx = np.array([pos[n] for n in nodes], dtype=int)
+    coo = adj.tocoo()
+    x = np.zeros(index['mean'].shape)
+    np.add.at(x, (idx[coo.row], idx[coo.col]), coo.data)
+    index['nnz'][idx[coo.row], idx[coo.col]] += sign
+
+    mean = index['mean']
+    count = index['count'] + sign
+    if count == 0:
+        mean[:] = 0
+        index['m2'][:] = 0
+    elif sign > 0:
+        delta = x - mean
+        mean += delta / count
+        index['m2'] += delta * (x - mean)
+    else:
+        old_mean = mean.copy()
+        mean -= (x - mean) / count
+        index['m2'] -= (x - mean) * (x - old_mean)
+        np.maximum(index['m2'], 0, out=index['m2'])
+        empty = index['nnz'] == 0
+        mean[empty] = 0
+        index['m2'][empty] = 0
+    index['count'] = count
+
+
+def connectome_std(index):
+    """
+    Sample standard deviation of the stored adjacency matrices.
+    """
+    if index['count'] < 2:
+        return np.zeros(index['m2'].shape)
+    return np.sqrt(index['m2'] / (index['count'] - 1))
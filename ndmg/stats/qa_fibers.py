@@ -34,7 +34,8 @@ try:
 except ImportError:
     pass
 
-def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples):
+def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples=1000,
+                   max_points=50):
     """
     Takes fiber streamlines and visualizes them using DiPy
     Required Arguments:
@@ -42,8 +43,9 @@ def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples):
         - atlasfile: Path to atlas file
         - outdir: Path to output directory
         - opacity: Opacity of overlayed brain
-        - num_samples: number of fibers to randomly sample from fibfile
     Optional Arguments:
+        - num_samples: number of fibers to randomly sample from fibfile
+        - max_points: most points drawn per sampled fiber
     """
     try:
         import vtk
@@ -52,15 +54,15 @@ def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples):
         print("!! VTK not found; skipping fiber QA.")
         return
 
-    # loading the fibers
-    fibs = threshold_fibers(fibs)
+    # randomly sample num_samples fibers from those above median length,
+    # in one pass and without copying the fibers
+    resampled_fibs = random_sample(threshold_fibers(fibs), num_samples)
 
     # make sure if fiber streamlines
     # have no fibers, no error occurs
-    if len(fibs) == 0:
+    if len(resampled_fibs) == 0:
         return
-    # randomly sample num_samples fibers from given fibers
-    resampled_fibs = random_sample(fibs, num_samples)
+    resampled_fibs = decimate_fibers(resampled_fibs, max_points)
 
     # load atlas file
     atlas_volume = load_atlas(atlasfile, opacity)
@@ -70,7 +72,7 @@ def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples):
     renderer.SetBackground(1.0, 1.0, 1.0)
 
     # Add streamlines as a DiPy viz object
-    stream_actor = actor.line(fibs)
+    stream_actor = actor.line(resampled_fibs)
 
     # Set camera orientation properties
     # TODO: allow this as an argument
@@ -85,36 +87,80 @@ def visualize_fibs(fibs, fibfile, atlasfile, outdir, opacity, num_samples):
     # window.show(renderer, size=(600, 600), reset_camera=False)
 
     fname = os.path.split(fibfile)[1].split('.')[0] + '.png'
-    window.record(renderer, out_path=outdir + fname, size=(600, 600))
+    record_offscreen(renderer, outdir + fname, size=(600, 600))
+
+
+def record_offscreen(renderer, out_path, size=(600, 600)):
+    '''
+    Renders a scene to a png without opening a window, so that it works on
+    headless machines (given a VTK built for offscreen rendering).
+    '''
+    render_window = vtk.vtkRenderWindow()
+    render_window.SetOffScreenRendering(1)
+    render_window.AddRenderer(renderer)
+    render_window.SetSize(*size)
+    render_window.Render()
+
+    to_image = vtk.vtkWindowToImageFilter()
+    to_image.SetInput(render_window)
+    to_image.Update()
+
+    writer = vtk.vtkPNGWriter()
+    writer.SetFileName(out_path)
+    writer.SetInputConnection(to_image.GetOutputPort())
+    writer.Write()
+    render_window.Finalize()
 
 
 def threshold_fibers(fibs):
     '''
     fibs: fibers as 2D array (N,3)
+
+    Yields the fibers above the median length, without copying them.
     '''
-    fib_lengths = [len(f) for f in fibs]
+    fib_lengths = np.fromiter((len(f) for f in fibs), dtype=int)
     if (len(fib_lengths) == 0):
-        return fib_lengths
+        return iter([])
     # calculate median of  fiber lengths
     med = np.median(fib_lengths)
     # get only fibers above the median length
-    long_fibs = [f for f in fibs if len(f) > med]
-    return long_fibs
+    return (f for idx, f in enumerate(fibs) if fib_lengths[idx] > med)
 
 
-def random_sample(fibs, num_samples):
+def random_sample(fibs, num_samples, seed=None):
     '''
-    fibs: fibers thresholded above median
+    fibs: fibers thresholded above median (any iterable)
     num_samples: number of fibers to sample from fibs
+
+    Reservoir sampling: a uniform sample of num_samples fibers (or all of
+    them, if there are fewer) in one pass, keeping only the sample.
+    '''
+    rand = random.Random(seed)
+    samples = []
+    for idx, f in enumerate(fibs):
+        if idx < num_samples:
+            samples.append(f)
+        else:
+            pos = rand.randint(0, idx)
+            if pos < num_samples:
+                samples[pos] = f
+    return samples
+
+
+def decimate_fibers(fibs, max_points):
+    '''
+    fibs: fibers to draw
+    max_points: most points kept per fiber
+
+    Keeps evenly spaced points of longer fibers, always including both ends.
     '''
-    # if the number of samples is more than amount
-    # of fibers available, then make num_samples
-    # equal number of fibers available
-    if (len(fibs) <= num_samples):
-        num_samples = len(fibs)
-    # generate the random sample indices
-    samples = random.sample(range(len(fibs)), num_samples)
-    return [fibs[i] for i in samples]
+    out = []
+    for f in fibs:
+        if len(f) > max_points:
+            keep = np.linspace(0, len(f) - 1, max_points).round().astype(int)
+            f = np.asarray(f)[keep]
+        out.append(f)
+    return out
 
 
 def load_atlas(path, opacity):
@@ -22,23 +22,34 @@
 from argparse import ArgumentParser
 from collections import OrderedDict
 from subprocess import Popen
-from scipy.stats import gaussian_kde
+from multiprocessing import Pool
 from ndmg.utils import loadGraphs
+from ndmg.stats.graph_stack import *
+from ndmg.stats.spectral import eigen_sequences
+from ndmg.stats.centrality import betweenness_centralities
+from ndmg.stats.kde import binned_kde
+from ndmg.stats.metric_store import *
+from ndmg.stats.metric_io import write_metric
 
 import numpy as np
-import nibabel as nb
-import networkx as nx
-import pickle
+import scipy.sparse as sp
 import sys
 import os
 
 
-def compute_metrics(fs, outdir, atlas, verb=False):
+def compute_metrics(fs, outdir, atlas, verb=False, neigs=None,
+                    bc_budget=3600, nproc=None, stack_bytes=2**29):
     """
     Given a set of files and a directory to put things, loads graphs and
-    performs set of analyses on them, storing derivatives in a pickle format
+    performs set of analyses on them, storing derivatives in a columnar format
     in the desired output location.
 
+    Per-subject results are kept in a store (<outdir>/store) keyed by graph
+    filename and content hash, so only new or changed graphs are loaded and
+    computed; study-wide outputs are then assembled from the store. Changing
+    `neigs` or `bc_budget` recomputes every graph. The store is local to the
+    output directory and is not pushed to S3.
+
     Required parameters:
         fs:
             - Dictionary of lists of files in each dataset
@@ -49,98 +60,173 @@ def compute_metrics(fs, outdir, atlas, verb=False):
     Optional parameters:
         verb:
             - Toggles verbose output statements
+        neigs:
+            - Number of Laplacian eigenvalues to keep per graph (all of them
+              for graphs of moderate size by default)
+        bc_budget:
+            - Seconds allowed for betweenness centrality before falling back
+              to a sampled estimate (None to always compute it exactly)
+        nproc:
+            - Number of worker processes of each parallel step (defaults to
+              the number of CPUs)
+        stack_bytes:
+            - Cap in bytes on the stacked per-subject arrays (see iter_stacks)
     """
-
-    graphs = loadGraphs(fs, verb=verb)
-    nodes = nx.number_of_nodes(graphs.values()[0])
+    storedir = os.path.join(outdir, 'store')
+    index = load_index(storedir)
+    hashes = OrderedDict((os.path.basename(f), file_hash(f)) for f in fs)
+    params = {'neigs': neigs, 'bc_budget': bc_budget}
+    stale = index.get('params') != params
+    if stale and index['graphs']:
+        print("Metric parameters changed; recomputing all graphs")
+    todo = [f for f in fs
+            if stale or index['graphs'].get(os.path.basename(f)) !=
+            hashes[os.path.basename(f)]]
+    gone = [subj for subj in index['graphs'] if subj not in hashes]
+    print("{} of {} graphs are new or changed".format(len(todo), len(fs)))
+
+    for subj in gone:
+        record = load_record(storedir, subj)
+        update_moments(index, record['nodes'], record['adj'], sign=-1)
+        remove_record(storedir, subj)
+        del index['graphs'][subj]
+
+    if len(todo) > 0:
+        graphs = loadGraphs(todo, verb=verb, nproc=nproc)
+        metrics = graph_metrics(graphs, neigs, bc_budget, nproc, stack_bytes)
+        for subj in graphs:
+            if subj in index['graphs']:
+                record = load_record(storedir, subj)
+                update_moments(index, record['nodes'], record['adj'], sign=-1)
+            nodes = list(graphs[subj].nodes())
+            record = {'hash': hashes[subj],
+                      'metrics': dict((m, metrics[m][subj]) for m in metrics),
+                      'nodes': nodes,
+                      'adj': sparse_adjacency(graphs[subj], nodes)}
+            save_record(storedir, subj, record)
+            update_moments(index, record['nodes'], record['adj'])
+            index['graphs'][subj] = hashes[subj]
+    index['params'] = params
+    save_index(storedir, index)
+
+    # Assemble study-wide outputs from the stored per-subject results
+    records = OrderedDict((subj, load_record(storedir, subj)['metrics'])
+                          for subj in hashes)
+
+    def collect(metric):
+        return OrderedDict((subj, records[subj][metric]) for subj in records)
 
     #  Number of non-zero edges (i.e. binary edge count)
-    print("Computing: NNZ")
-    nnz = OrderedDict((subj, len(nx.edges(graphs[subj]))) for subj in graphs)
+    nnz = collect('number_non_zeros')
     write(outdir, 'number_non_zeros', nnz, atlas)
-    print("Sample Mean: %.2f" % np.mean(nnz.values()))
+    print("Sample Mean: %.2f" % np.mean(list(nnz.values())))
 
     #  Degree sequence
-    print("Computing: Degree Sequence")
-    total_deg = OrderedDict((subj, np.array(nx.degree(graphs[subj]).values()))
-                            for subj in graphs)
+    deg = {'total_deg': collect('total_deg'),
+           'ipso_deg': collect('ipso_deg'),
+           'contra_deg': collect('contra_deg')}
+    write(outdir, 'degree_distribution', deg, atlas)
+    show_means(deg['total_deg'])
+
+    for metric in ['edge_weight', 'clustering_coefficients',
+                   'locality_statistic', 'betweenness_centrality']:
+        data = collect(metric)
+        write(outdir, metric, data, atlas)
+        show_means(data)
+
+    eigs = collect('eigen_sequence')
+    write(outdir, 'eigen_sequence', eigs, atlas)
+    print("Subject Maxes: " + ", ".join(["%.2f" % np.max(eigs[key])
+                                         for key in eigs.keys()]))
+
+    # Mean and standard deviation connectomes, over the union of all nodes
+    print("Computing: Mean Connectome")
+    write(outdir, 'study_mean_connectome', index['mean'], atlas)
+    write(outdir, 'study_std_connectome', connectome_std(index), atlas)
+
+
+def graph_metrics(graphs, neigs=None, bc_budget=3600, nproc=None,
+                  stack_bytes=2**29):
+    """
+    Computes the per-subject metrics of a set of graphs, returning a
+    dictionary of metric name to dictionary of subject to value.
+
+    Required parameters:
+        graphs:
+            - Dictionary of graphs
+    Optional parameters:
+        neigs, bc_budget, nproc, stack_bytes:
+            - See compute_metrics
+    """
+    nodes = node_order(graphs)
+
+    #  Per-subject metrics are computed on stacks of subjects at a time with
+    #  vectorized reductions, then mapped back onto each graph's own nodes.
+    #  Graphs too large to stack densely are done one at a time, sparsely.
+    print("Computing: NNZ, Degree Sequence, Edge Weight Sequence, "
+          "Clustering Coefficient Sequence")
+    nnz = OrderedDict()
+    total_deg = OrderedDict()
     ipso_deg = OrderedDict()
     contra_deg = OrderedDict()
-    for subj in graphs:  # TODO GK: remove forloop and use comprehension maybe?
-        g = graphs[subj]
-        N = len(g.nodes())
-        LLnodes = g.nodes()[0:N/2]  # TODO GK: don't assume hemispheres
-        LL = g.subgraph(LLnodes)
-        LLdegs = [LL.degree()[n] for n in LLnodes]
-
-        RRnodes = g.nodes()[N/2:N]  # TODO GK: don't assume hemispheres
-        RR = g.subgraph(RRnodes)
-        RRdegs = [RR.degree()[n] for n in RRnodes]
-
-        LRnodes = g.nodes()
-        ipso_list = LLdegs + RRdegs
-        degs = [g.degree()[n] for n in LRnodes]
-        contra_deg[subj] = [a_i - b_i for a_i, b_i in zip(degs, ipso_list)]
-        ipso_deg[subj] = ipso_list
-        # import pdb; pdb.set_trace()
-
-    deg = {'total_deg': total_deg,
-           'ipso_deg': ipso_deg,
-           'contra_deg': contra_deg}
-    write(outdir, 'degree_distribution', deg, atlas)
-    show_means(total_deg)
-
-    #  Edge Weights
-    print("Computing: Edge Weight Sequence")
-    temp_ew = OrderedDict((s, [graphs[s].get_edge_data(e[0], e[1])['weight']
-                           for e in graphs[s].edges()]) for s in graphs)
-    ew = temp_ew
-    write(outdir, 'edge_weight', ew, atlas)
-    show_means(temp_ew)
-
-    #   Clustering Coefficients
-    print("Computing: Clustering Coefficient Sequence")
-    temp_cc = OrderedDict((subj, nx.clustering(graphs[subj]).values())
-                          for subj in graphs)
-    ccoefs = temp_cc
-    write(outdir, 'clustering_coefficients', ccoefs, atlas)
-    show_means(temp_cc)
+    ew = OrderedDict()
+    ccoefs = OrderedDict()
+    if len(nodes) > dense_max_nodes:
+        stacks = list()
+        for subj in graphs:
+            edges, degs, ipso, contra, weights, cc = sparse_metrics(
+                graphs[subj])
+            nnz[subj] = edges
+            total_deg[subj] = degs.astype(int)
+            ipso_deg[subj] = ipso.astype(int).tolist()
+            contra_deg[subj] = contra.astype(int).tolist()
+            ew[subj] = weights.tolist()
+            ccoefs[subj] = cc.tolist()
+    else:
+        stacks = iter_stacks(graphs, nodes, stack_bytes)
+    for subjs, A, E in stacks:
+        idxs = [subject_index(graphs[subj], nodes) for subj in subjs]
+        halves = np.zeros(E.shape[:2])
+        # Hemispheres are the first and second half of each node order
+        for s, idx in enumerate(idxs):
+            halves[s, idx[len(idx)//2:]] = 1
+        edges = number_non_zeros(E)
+        degs = degrees(E)
+        ipso, contra = hemisphere_degrees(E, halves)
+        cc = clustering(E)
+        for s, subj in enumerate(subjs):
+            idx = idxs[s]
+            nnz[subj] = int(edges[s])
+            total_deg[subj] = degs[s, idx].astype(int)
+            ipso_deg[subj] = ipso[s, idx].astype(int).tolist()
+            contra_deg[subj] = contra[s, idx].astype(int).tolist()
+            ew[subj] = edge_weights(A, E, s, idx).tolist()
+            ccoefs[subj] = cc[s, idx].tolist()
 
     # Scan Statistic-1
     print("Computing: Max Local Statistic Sequence")
-    temp_ss1 = scan_statistic(graphs, 1)
-    ss1 = temp_ss1
-    write(outdir, 'locality_statistic', ss1, atlas)
-    show_means(temp_ss1)
+    ss1 = scan_statistic(graphs, 1, nproc)
 
     # Eigen Values
     print("Computing: Eigen Value Sequence")
-    laplac = OrderedDict((subj, nx.normalized_laplacian_matrix(graphs[subj]))
-                         for subj in graphs)
-    eigs = OrderedDict((subj, np.sort(np.linalg.eigvals(laplac[subj].A))[::-1])
-                       for subj in graphs)
-    write(outdir, 'eigen_sequence', eigs, atlas)
-    print("Subject Maxes: " + ", ".join(["%.2f" % np.max(eigs[key])
-                                         for key in eigs.keys()]))
+    eigs = eigen_sequences(graphs, neigs, nproc)
 
     # Betweenness Centrality
     print("Computing: Betweenness Centrality Sequence")
-    nxbc = nx.algorithms.betweenness_centrality  # For PEP8 line length...
-    temp_bc = OrderedDict((subj, nxbc(graphs[subj]).values())
-                          for subj in graphs)
-    centrality = temp_bc
-    write(outdir, 'betweenness_centrality', centrality, atlas)
-    show_means(temp_bc)
-
-    # Mean connectome
-    print("Computing: Mean Connectome")
-    adj = OrderedDict((subj, nx.adj_matrix(graphs[subj]).todense())
-                      for subj in graphs)
-    mat = np.zeros(adj.values()[0].shape)
-    for subj in adj:
-        mat += adj[subj]
-    mat = mat/len(adj.keys())
-    write(outdir, 'study_mean_connectome', mat, atlas)
+    temp_bc, _ = betweenness_centralities(graphs, budget=bc_budget,
+                                          nproc=nproc)
+    centrality = OrderedDict((subj, temp_bc[subj].tolist())
+                             for subj in temp_bc)
+
+    return OrderedDict([('number_non_zeros', nnz),
+                        ('total_deg', total_deg),
+                        ('ipso_deg', ipso_deg),
+                        ('contra_deg', contra_deg),
+                        ('edge_weight', ew),
+                        ('clustering_coefficients', ccoefs),
+                        ('locality_statistic', ss1),
+                        ('eigen_sequence', eigs),
+                        ('betweenness_centrality', centrality)])
 
 
 def show_means(data):
@@ -148,53 +234,89 @@ def show_means(data):
                                          for key in data.keys()]))
 
 
-def scan_statistic(mygs, i):
+def scan_statistic(mygs, i, nproc=None):
     """
     Computes scan statistic-i on a set of graphs
 
+    The statistic of a node is the total edge weight of the subgraph induced
+    by its radius-i neighbourhood. Neighbourhoods are found as the non-zeros
+    of (I + A)^i on the sparse adjacency, so that the statistic of every node
+    is a row sum of (R W) * R, and graphs are processed in parallel.
+
     Required Parameters:
         mygs:
             - Dictionary of graphs
         i:
             - which scan statistic to compute
+    Optional Parameters:
+        nproc:
+            - Number of worker processes (defaults to the number of CPUs)
+    """
+    adjs = [(sparse_adjacency(mygs[key]), i) for key in mygs.keys()]
+    if nproc == 1 or len(adjs) < 2:
+        stats = [_scan_statistic(adj) for adj in adjs]
+    else:
+        pool = Pool(nproc)
+        try:
+            stats = pool.map(_scan_statistic, adjs)
+        finally:
+            pool.close()
+            pool.join()
+    return OrderedDict(zip(mygs.keys(), stats))
+
+
+def _scan_statistic(args):
+    """
+    Scan statistic-i of every node of one sparse weighted adjacency matrix.
     """
-    ss = OrderedDict()
-    for key in mygs.keys():
-        g = mygs[key]
-        tmp = np.array(())
-        for n in g.nodes():
-            sg = nx.ego_graph(g, n, radius=i)
-            tmp = np.append(tmp, np.sum([sg.get_edge_data(e[0], e[1])['weight']
-                            for e in sg.edges()]))
-        ss[key] = tmp
-    return ss
+    W, i = args
+    W = sp.csr_matrix(W)
+    step = W.copy()
+    step.data[:] = 1
+    step = step + sp.identity(W.shape[0], format='csr')
+    R = sp.identity(W.shape[0], format='csr')
+    for _ in range(i):
+        R = R.dot(step)
+        R.data[:] = 1
+    # Each off-diagonal edge appears twice in r'Wr, self-loops once
+    inner = np.asarray(R.dot(W).multiply(R).sum(axis=1)).ravel()
+    loops = R.dot(W.diagonal())
+    return (inner + loops) / 2.0
 
 
 def density(data, nbins=500, rng=None):
     """
     Computes density for metrics which return vectors
 
+    Densities are estimated with a binned FFT kernel density estimate,
+    within 1e-3 of gaussian_kde relative to each density's peak (see
+    ndmg.stats.kde.binned_kde).
+
     Required parameters:
         data:
             - Dictionary of the vectors of data
     """
     density = OrderedDict()
     xs = OrderedDict()
-    for subj in data:
-        hist = np.histogram(data[subj], nbins)
-        hist = np.max(hist[0])
-        dens = gaussian_kde(data[subj])
+    subjs = list(data.keys())
+    vecs = [np.ravel(np.asarray(data[subj], dtype=float)) for subj in subjs]
+    for subj, vec in zip(subjs, vecs):
         if rng is not None:
             xs[subj] = np.linspace(rng[0], rng[1], nbins)
         else:
-            xs[subj] = np.linspace(0, np.max(data[subj]), nbins)
-        density[subj] = dens.evaluate(xs[subj])*np.max(data[subj]*hist)
+            xs[subj] = np.linspace(0, np.max(vec), nbins)
+    pdfs = binned_kde(vecs, list(xs.values()))
+    for subj, vec, pdf in zip(subjs, vecs, pdfs):
+        hist = np.histogram(vec, nbins)
+        hist = np.max(hist[0])
+        density[subj] = pdf*np.max(vec*hist)
     return {"xs": xs, "pdfs": density}
 
 
 def write(outdir, metric, data, atlas):
     """
-    Write computed derivative to disk in a pickle file
+    Write computed derivative to disk as a columnar metric directory (see
+    ndmg.stats.metric_io)
 
     Required parameters:
         outdir:
@@ -206,8 +328,7 @@ def write(outdir, metric, data, atlas):
         atlas:
             - Name of atlas of interest as it appears in the directory titles
     """
-    with open(outdir + '/' + atlas + '_' + metric + '.pkl', 'wb') as of:
-        pickle.dump({metric: data}, of)
+    write_metric(outdir + '/' + atlas + '_' + metric, metric, data)
 
 
 def main():
@@ -21,28 +21,31 @@
 
 from argparse import ArgumentParser
 from plotly.offline import download_plotlyjs, init_notebook_mode, iplot, plot
-import pickle
+from ndmg.stats.metric_io import is_metric, read_metric
 import plotly_helper as pp
 import numpy as np
 import os
 
+panels = ['betweenness_centrality', 'clustering_coefficients',
+          'degree_distribution', 'edge_weight', 'eigen_sequence',
+          'locality_statistic', 'number_non_zeros', 'study_mean_connectome']
+
 
 def make_panel_plot(basepath, outf, dataset=None, atlas=None, minimal=True,
                     log=True, hemispheres=True):
     fnames = [name for name in os.listdir(basepath)
-              if os.path.splitext(name)[1] == '.pkl']
+              if is_metric(os.path.join(basepath, name)) and
+              "_".join(name.split('_')[1:]) in panels]
     fnames = sorted(fnames)
     paths = [os.path.join(basepath, item) for item in fnames]
-    keys = ["_".join(n.split('.')[0].split('_')[1:]) for n in fnames]
+    keys = ["_".join(n.split('_')[1:]) for n in fnames]
     labs = ['Betweenness Centrality', 'Clustering Coefficient', 'Degree',
             'Edge Weight', 'Eigenvalue', 'Locality Statistic-1',
             'Number of Non-zeros', 'Mean Connectome']
 
     traces = list(())
     for idx, curr in enumerate(paths):
-        f = open(curr)
-        dat = pickle.load(f)[keys[idx]]
-        f.close()
+        dat = read_metric(curr)[keys[idx]]
         if keys[idx] == 'number_non_zeros':
             fig = pp.plot_rugdensity(dat.values())
         elif keys[idx] == 'edge_weight':
@@ -140,7 +143,7 @@ def make_panel_plot(basepath, outf, dataset=None, atlas=None, minimal=True,
 
 def main():
     parser = ArgumentParser(description="This is a graph qc plotting tool.")
-    parser.add_argument("basepath", action="store", help="qc metric .pkl dir")
+    parser.add_argument("basepath", action="store", help="qc metric dir")
     parser.add_argument("dataset", action="store", help="dataset name")
     parser.add_argument("atlas", action="store", help="atlas name")
     parser.add_argument("outf", action="store", help="outfile name for plot")
@@ -27,90 +27,77 @@ import numpy as np
 import nibabel as nb
 import ndmg.utils as mgu
 from argparse import ArgumentParser
-from scipy import ndimage
 from matplotlib.colors import LinearSegmentedColormap
-import matplotlib as mpl
-mpl.use('Agg')  # very important above pyplot import
+from ndmg.stats.qa_render import slice_panel
 
-import matplotlib.pyplot as plt
 
+chunk_bytes = 2**28  # most data read at once when averaging volumes
 
-def reg_mri_pngs(mri, atlas, outdir, loc=0, mean=False, dim=4):
+
+def reg_mri_pngs(mri, atlas, outdir, loc=0, mean=False, dim=4, panel=None):
     """
     outdir: directory where output png file is saved
     fname: name of output file WITHOUT FULL PATH. Path provided in outdir.
+    panel: slice_panel to render with, to reuse one across many calls
     """
 
-    atlas_data = nb.load(atlas).get_data()
-    mri_data = nb.load(mri).get_data()
-    if dim==4:  # 4d data, so we need to reduce a dimension
-        if mean:
-            b0_data = mri_data.mean(axis=3)
-        else:
-            b0_data = mri_data[:,:,:,loc]
-    else:  # dim=3
-        b0_data = mri_data
+    atlas_data = np.asanyarray(load_proxy(atlas).dataobj)
+    b0_data = load_volume(mri, loc=loc, mean=mean, dim=dim)
 
     cmap1 = LinearSegmentedColormap.from_list('mycmap1', ['black', 'magenta'])
     cmap2 = LinearSegmentedColormap.from_list('mycmap2', ['black', 'green'])
 
-    fig = plot_overlays(atlas_data, b0_data, (cmap1, cmap2))
-
     # name and save the file
     fname = os.path.split(mri)[1].split(".")[0] + '.png'
-    plt.savefig(outdir + '/' + fname, format='png')
+    plot_overlays(atlas_data, b0_data, (cmap1, cmap2), outdir + '/' + fname,
+                  panel)
+
 
+def load_proxy(path):
+    """
+    Loads an image without reading its data, keeping the file open between
+    reads of its array proxy where nibabel allows it.
+    """
+    try:
+        return nb.load(path, keep_file_open=True)
+    except TypeError:  # older nibabel
+        return nb.load(path)
 
-def plot_overlays(atlas, b0, cmaps):
-    plt.rcParams.update({'axes.labelsize': 'x-large',
-                         'axes.titlesize': 'x-large'})
 
-    if b0.shape == (182, 218, 182):
-        x = [78, 90, 100]
-        y = [82, 107, 142]
-        z = [88, 103, 107]
+def load_volume(mri, loc=0, mean=False, dim=4):
+    """
+    Reads the 3d volume of an image to plot through nibabel's array proxy,
+    so that only the data needed is read: volume `loc` of 4d data (which for
+    a compressed file only decompresses up to that volume), or the mean of
+    all volumes accumulated a chunk of volumes at a time.
+    """
+    proxy = load_proxy(mri).dataobj
+    if dim != 4:  # dim=3
+        return np.asanyarray(proxy)
+    if not mean:
+        return np.asarray(proxy[..., loc])
+    shape = proxy.shape
+    step = max(1, int(chunk_bytes // (8 * np.prod(shape[:3]))))
+    total = np.zeros(shape[:3])
+    for start in range(0, shape[3], step):
+        chunk = np.asarray(proxy[..., start:start + step], dtype=np.float64)
+        total += chunk.sum(axis=3)
+    return total / shape[3]
+
+
+def plot_overlays(atlas, b0, cmaps, outf, panel=None):
+    """
+    Saves a png of slices of a volume overlaid on the atlas.
+    """
+    layers = [(atlas, {'interpolation': 'none', 'cmap': cmaps[0],
+                       'alpha': 0.5}),
+              (b0, {'interpolation': 'none', 'cmap': cmaps[1], 'alpha': 0.5,
+                    'limits': get_min_max})]
+    if panel is not None:
+        panel.render(layers, outf)
     else:
-        shap = b0.shape
-        x = [int(shap[0]*0.35), int(shap[0]*0.51), int(shap[0]*0.65)]
-        y = [int(shap[1]*0.35), int(shap[1]*0.51), int(shap[1]*0.65)]
-        z = [int(shap[2]*0.35), int(shap[2]*0.51), int(shap[2]*0.65)]
-    coords = (x, y, z)
-
-    labs = ['Sagittal Slice (YZ fixed)',
-            'Coronal Slice (XZ fixed)',
-            'Axial Slice (XY fixed)']
-    var = ['X', 'Y', 'Z']
-    # create subplot for first slice
-    # and customize all labels
-    idx = 0
-    for i, coord in enumerate(coords):
-        for pos in coord:
-            idx += 1
-            ax = plt.subplot(3, 3, idx)
-            ax.set_title(var[i] + " = " + str(pos))
-            if i == 0:
-                image = ndimage.rotate(b0[pos, :, :], 90)
-                atl = ndimage.rotate(atlas[pos, :, :], 90)
-            elif i == 1:
-                image = ndimage.rotate(b0[:, pos, :], 90)
-                atl = ndimage.rotate(atlas[:, pos, :], 90)
-            else:
-                image = b0[:, :, pos]
-                atl = atlas[:, :, pos]
-
-            if idx % 3 == 1:
-                ax.set_ylabel(labs[i])
-                ax.yaxis.set_ticks([0, image.shape[0]/2, image.shape[0] - 1])
-                ax.xaxis.set_ticks([0, image.shape[1]/2, image.shape[1] - 1])
-
-            min_val, max_val = get_min_max(image)
-            plt.imshow(atl, interpolation='none', cmap=cmaps[0], alpha=0.5)
-            plt.imshow(image, interpolation='none', cmap=cmaps[1], alpha=0.5,
-                       vmin=min_val, vmax=max_val)
-
-    fig = plt.gcf()
-    fig.set_size_inches(12.5, 10.5, forward=True)
-    return fig
+        with slice_panel() as panel:
+            panel.render(layers, outf)
 
 
 def get_min_max(data):
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# qa_render.py
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import numpy as np
+
+labs = ['Sagittal Slice (YZ fixed)',
+        'Coronal Slice (XZ fixed)',
+        'Axial Slice (XY fixed)']
+var = ['X', 'Y', 'Z']
+
+
+def slice_coords(shape):
+    """
+    The three sagittal, coronal and axial slices shown of a volume.
+    """
+    if tuple(shape[:3]) == (182, 218, 182):
+        x = [78, 90, 100]
+        y = [82, 107, 142]
+        z = [88, 103, 107]
+    else:
+        x = [int(shape[0]*0.35), int(shape[0]*0.51), int(shape[0]*0.65)]
+        y = [int(shape[1]*0.35), int(shape[1]*0.51), int(shape[1]*0.65)]
+        z = [int(shape[2]*0.35), int(shape[2]*0.51), int(shape[2]*0.65)]
+    return (x, y, z)
+
+
+def slice_views(vol, coords):
+    """
+    The 2d images of the given slices of a volume (or of an RGB volume),
+    sagittal and coronal ones turned upright as rot90 views (no copy or
+    interpolation).
+    """
+    views = []
+    for i, coord in enumerate(coords):
+        for pos in coord:
+            if i == 0:
+                views += [np.rot90(vol[pos, :, :])]
+            elif i == 1:
+                views += [np.rot90(vol[:, pos, :])]
+            else:
+                views += [vol[:, :, pos]]
+    return views
+
+
+class slice_panel(object):
+    """
+    A reusable 3x3 figure of sagittal, coronal and axial slices, drawn
+    without pyplot's global state. One panel renders any number of volumes
+    in turn: the figure and axes are made once, and the images are updated
+    in place while the volume shapes stay the same. Call close() when done
+    (or use it in a with statement) to release the figure.
+    """
+    def __init__(self, size=(12.5, 10.5)):
+        self.fig = Figure(figsize=size)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.axes = [self.fig.add_subplot(3, 3, idx + 1) for idx in range(9)]
+        self.key = None
+        self.images = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.fig is not None:
+            self.fig.clf()
+            self.fig = None
+            self.canvas = None
+
+    def render(self, layers, outf):
+        """
+        Draws the slices of one or more volumes overlaid and saves the
+        figure as a png.
+
+        Required parameters:
+            layers:
+                - List of (volume, options) drawn bottom to top, where the
+                  options are passed to imshow, except 'limits': a function
+                  of each 2d slice giving its (vmin, vmax)
+            outf:
+                - Filename of the png
+        """
+        coords = slice_coords(layers[0][0].shape)
+        key = (tuple(vol.shape for vol, opts in layers), coords)
+        views = [slice_views(vol, coords) for vol, opts in layers]
+        if key != self.key:
+            self._draw(layers, views, coords)
+            self.key = key
+        else:
+            for l, (vol, opts) in enumerate(layers):
+                for idx in range(9):
+                    self.images[l][idx].set_data(views[l][idx])
+                    if 'limits' in opts:
+                        self.images[l][idx].set_clim(
+                            *opts['limits'](views[l][idx]))
+                    elif views[l][idx].ndim == 2:
+                        self.images[l][idx].autoscale()
+        self.fig.savefig(outf, format='png')
+
+    def _draw(self, layers, views, coords):
+        self.images = [[] for layer in layers]
+        for idx, ax in enumerate(self.axes):
+            ax.clear()
+            i = idx // 3
+            ax.set_title(var[i] + " = " + str(coords[i][idx % 3]),
+                         fontsize='x-large')
+            shape = views[0][idx].shape
+            if idx % 3 == 0:
+                ax.set_ylabel(labs[i], fontsize='x-large')
+                ax.yaxis.set_ticks([0, shape[0]//2, shape[0] - 1])
+                ax.xaxis.set_ticks([0, shape[1]//2, shape[1] - 1])
+            for l, (vol, opts) in enumerate(layers):
+                opts = dict(opts)
+                limits = opts.pop('limits', None)
+                if limits is not None:
+                    opts['vmin'], opts['vmax'] = limits(views[l][idx])
+                self.images[l] += [ax.imshow(views[l][idx], **opts)]
+
+
+def render_many(jobs, size=(12.5, 10.5)):
+    """
+    Renders a batch of slice figures with one shared panel, e.g. for QA
+    sweeps over many sessions in one process.
+
+    Required parameters:
+        jobs:
+            - Iterable of (layers, outf), as taken by slice_panel.render
+    """
+    with slice_panel(size) as panel:
+        for layers, outf in jobs:
+            panel.render(layers, outf)
@@ -22,23 +22,20 @@
 
 from dipy.reconst.dti import fractional_anisotropy, color_fa
 from argparse import ArgumentParser
-from scipy import ndimage
+from ndmg.stats.qa_render import slice_panel
 import os
 import re
 import numpy as np
 import nibabel as nb
 import sys
-import matplotlib
 
-matplotlib.use('Agg')  # very important above pyplot import
-import matplotlib.pyplot as plt
 
-
-def tensor2fa(tensors, tensor_name, dwi, derivdir, qcdir):
+def tensor2fa(tensors, tensor_name, dwi, derivdir, qcdir, panel=None):
     '''
     outdir: location of output directory.
     fname: name of output fa map file. default is none (name created based on
     input file)
+    panel: slice_panel to render with, to reuse one across many calls
     '''
     dwi_data = nb.load(dwi)
     affine = dwi_data.get_affine()
@@ -56,59 +53,25 @@ def tensor2fa(tensors, tensor_name, dwi, derivdir, qcdir):
     fa = nb.Nifti1Image(np.array(255 * RGB, 'uint8'), affine)
     nb.save(fa, derivdir + fname)
 
-    fa_pngs(fa, fname, qcdir)
+    fa_pngs(fa, fname, qcdir, panel)
 
 
-def fa_pngs(data, fname, outdir):
+def fa_pngs(data, fname, outdir, panel=None):
     '''
     data: fa map
     '''
     im = data.get_data()
-    fig = plot_rgb(im)
     fname = os.path.split(fname)[1].split(".")[0] + '.png'
-    plt.savefig(outdir + fname, format='png')
-
+    plot_rgb(im, outdir + fname, panel)
 
-def plot_rgb(im):
-    plt.rcParams.update({'axes.labelsize': 'x-large',
-                         'axes.titlesize': 'x-large'})
 
-    if im.shape == (182, 218, 182):
-        x = [78, 90, 100]
-        y = [82, 107, 142]
-        z = [88, 103, 107]
+def plot_rgb(im, outf, panel=None):
+    """
+    Saves a png of slices of an RGB volume.
+    """
+    layers = [(im, {})]
+    if panel is not None:
+        panel.render(layers, outf)
     else:
-        shap = im.shape
-        x = [int(shap[0]*0.35), int(shap[0]*0.51), int(shap[0]*0.65)]
-        y = [int(shap[1]*0.35), int(shap[1]*0.51), int(shap[1]*0.65)]
-        z = [int(shap[2]*0.35), int(shap[2]*0.51), int(shap[2]*0.65)]
-    coords = (x, y, z)
-
-    labs = ['Sagittal Slice (YZ fixed)',
-            'Coronal Slice (XZ fixed)',
-            'Axial Slice (XY fixed)']
-    var = ['X', 'Y', 'Z']
-
-    idx = 0
-    for i, coord in enumerate(coords):
-        for pos in coord:
-            idx += 1
-            ax = plt.subplot(3, 3, idx)
-            ax.set_title(var[i] + " = " + str(pos))
-            if i == 0:
-                image = ndimage.rotate(im[pos, :, :], 90)
-            elif i == 1:
-                image = ndimage.rotate(im[:, pos, :], 90)
-            else:
-                image = im[:, :, pos]
-
-            if idx % 3 == 1:
-                ax.set_ylabel(labs[i])
-                ax.yaxis.set_ticks([0, image.shape[0]/2, image.shape[0] - 1])
-                ax.xaxis.set_ticks([0, image.shape[1]/2, image.shape[1] - 1])
-
-            plt.imshow(image)
-
-    fig = plt.gcf()
-    fig.set_size_inches(12.5, 10.5, forward=True)
-    return fig
+        with slice_panel() as panel:
+            panel.render(layers, outf)
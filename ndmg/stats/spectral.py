@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# spectral.py
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from multiprocessing import Pool
+from scipy.sparse.linalg import eigsh
+from ndmg.stats.graph_stack import sparse_adjacency
+
+import numpy as np
+import scipy.sparse as sp
+
+dense_max = 2000  # largest graph whose full spectrum is computed densely
+default_neigs = 100  # eigenvalues kept for graphs larger than dense_max
+
+
+def normalized_laplacian(W):
+    """
+    Sparse normalized Laplacian D^-1/2 (D - W) D^-1/2 of a weighted adjacency
+    matrix, as computed by networkx (isolated nodes get an all-zero row).
+    """
+    W = sp.csr_matrix(W)
+    deg = np.asarray(W.sum(axis=1)).ravel()
+    with np.errstate(divide='ignore'):
+        dh = 1.0 / np.sqrt(deg)
+    dh[np.isinf(dh)] = 0
+    DH = sp.diags(dh)
+    return sp.csr_matrix(DH.dot(sp.diags(deg) - W).dot(DH))
+
+
+def eigen_sequence(W, neigs=None):
+    """
+    Eigenvalues of the normalized Laplacian of a graph, in decreasing order.
+
+    Graphs with up to `dense_max` nodes use the symmetric dense solver. Larger
+    graphs use Lanczos iterations on the sparse Laplacian for the top and
+    bottom neigs/2 eigenvalues each; as the spectrum lies in [0, 2], the
+    bottom ones are found as the top of 2I - L, which converges far faster.
+
+    Required parameters:
+        W:
+            - Weighted adjacency matrix (dense or sparse)
+    Optional parameters:
+        neigs:
+            - Number of eigenvalues to return; all of them by default for
+              graphs up to dense_max nodes, default_neigs beyond
+    """
+    L = normalized_laplacian(W)
+    N = L.shape[0]
+    if neigs is None and N > dense_max:
+        neigs = default_neigs
+    if N <= dense_max or neigs >= N - 1:
+        eigs = np.sort(np.linalg.eigvalsh(L.toarray()))[::-1]
+        if neigs is not None and neigs < N:
+            eigs = np.concatenate((eigs[:neigs - neigs//2],
+                                   eigs[N - neigs//2:]))
+        return eigs
+
+    top = eigsh(L, k=neigs - neigs//2, which='LA', return_eigenvectors=False)
+    eigs = [top]
+    if neigs//2 > 0:
+        shift = 2 * sp.identity(N, format='csr') - L
+        bottom = eigsh(shift, k=neigs//2, which='LA',
+                       return_eigenvectors=False)
+        eigs += [2 - bottom]
+    return np.sort(np.concatenate(eigs))[::-1]
+
+
+def _eigen_sequence(args):
+    return eigen_sequence(*args)
+
+
+def eigen_sequences(graphs, neigs=None, nproc=None):
+    """
+    Computes the eigenvalue sequence of each graph in parallel.
+
+    Required parameters:
+        graphs:
+            - Dictionary of graphs
+    Optional parameters:
+        neigs:
+            - Number of eigenvalues to keep per graph (see eigen_sequence)
+        nproc:
+            - Number of worker processes (defaults to the number of CPUs)
+    """
+    args = [(sparse_adjacency(graphs[subj]), neigs) for subj in graphs]
+    if nproc == 1 or len(args) < 2:
+        eigs = [_eigen_sequence(a) for a in args]
+    else:
+        pool = Pool(nproc)
+        try:
+            eigs = pool.map(_eigen_sequence, args)
+        finally:
+            pool.close()
+            pool.join()
+    return OrderedDict(zip(graphs.keys(), eigs))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# fiber_store.py
+
+import numpy as np
+import os.path as op
+import struct
+import zipfile
+import os
+
+
+def save_fibers(fname, fibers):
+    """
+    Saves streamlines as one contiguous float32 (points, 3) array and the
+    offsets of each streamline in it, in an uncompressed .npz (so that the
+    points can be memory-mapped straight from the file).
+
+    **Positional Arguments:**
+
+            fname:
+                - Output .npz file
+            fibers:
+                - Iterable of (n, 3) streamline arrays
+    """
+    lengths = [len(f) for f in fibers]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    points = np.zeros((offsets[-1], 3), dtype=np.float32)
+    for idx, f in enumerate(fibers):
+        points[offsets[idx]:offsets[idx + 1]] = f
+    np.savez(fname, points=points, offsets=offsets)
+
+
+def load_fibers(fname, mmap=True):
+    """
+    Loads streamlines saved by save_fibers, memory-mapping the points by
+    default so that only the streamlines used are read. Files written with
+    np.savez of a list of streamlines are read as before (a list).
+    """
+    with np.load(fname) as npz:
+        if 'offsets' not in npz.files:
+            with np.load(fname, allow_pickle=True) as old:
+                return list(old[old.files[0]])
+        offsets = npz['offsets']
+        points = None if mmap else npz['points']
+    if points is None:
+        points = _member_memmap(fname, 'points')
+    return fiber_store(points, offsets)
+
+
+def compact_fibers(fname, tmpdir):
+    """
+    Returns a fiber file in the save_fibers format: the file itself if it
+    already is, or else a copy converted to it in `tmpdir` (reused while it
+    is newer than the original). Old files hold pickled streamlines, which
+    every reader would otherwise unpickle in full.
+    """
+    with np.load(fname) as npz:
+        if 'offsets' in npz.files:
+            return fname
+    outf = op.join(tmpdir, op.basename(fname))
+    if op.isfile(outf) and op.getmtime(outf) >= op.getmtime(fname):
+        return outf
+    if not op.isdir(tmpdir):
+        os.makedirs(tmpdir)
+    tmpf = outf + '.tmp{}.npz'.format(os.getpid())
+    save_fibers(tmpf, load_fibers(fname))
+    os.rename(tmpf, outf)
+    return outf
+
+
+def _member_memmap(fname, name):
+    """
+    Memory-maps an array stored uncompressed in an .npz file.
+    """
+    with zipfile.ZipFile(fname) as zf:
+        info = zf.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("{} is compressed in {}".format(name, fname))
+    with open(fname, 'rb') as inf:
+        # Skip the zip local file header, then the .npy header
+        inf.seek(info.header_offset)
+        head = inf.read(30)
+        nlen, xlen = struct.unpack('<HH', head[26:30])
+        inf.seek(info.header_offset + 30 + nlen + xlen)
+        version = np.lib.format.read_magic(inf)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(inf)
+        else:
+            header = np.lib.format.read_array_header_2_0(inf)
+        shape, fortran, dtype = header
+        offset = inf.tell()
+    return np.memmap(fname, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran else 'C')
+
+
+class fiber_store(object):
+
+    def __init__(self, points, offsets):
+        """
+        Streamlines kept as one flat array of points and the offsets of each
+        streamline in it. Indexing gives one streamline (a view), and slicing
+        a list of them, without reading the others.
+        """
+        self.points = points
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("streamline index out of range")
+        return self.points[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def lengths(self):
+        """
+        Number of points of each streamline.
+        """
+        return np.diff(self.offsets)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# tensor_store.py
+
+import numpy as np
+
+# Order of the six unique components, as in dipy's lower_triangular
+components = ['Dxx', 'Dxy', 'Dyy', 'Dxz', 'Dyz', 'Dzz']
+lower = ([0, 1, 1, 2, 2, 2], [0, 0, 1, 0, 1, 2])
+
+
+def save_tensors(fname, fit, mask, affine):
+    """
+    Saves a tensor fit compactly: the six unique tensor components of the
+    voxels in the mask only, as float32, with the mask and affine (a
+    compressed .npz of plain arrays, so nothing is pickled).
+
+    **Positional Arguments:**
+
+            fname:
+                - Output .npz file
+            fit:
+                - dipy TensorFit of the whole volume
+            mask:
+                - Brain mask the tensors were fit in
+            affine:
+                - Affine of the volume
+    """
+    mask = np.asarray(mask) > 0
+    tensor = fit.lower_triangular()[mask].astype(np.float32)
+    np.savez_compressed(fname, tensor=tensor, mask=mask,
+                        affine=np.asarray(affine, dtype=np.float64))
+
+
+def load_tensors(fname):
+    """
+    Loads tensors saved by save_tensors. Derived maps are only computed
+    when first used.
+    """
+    return tensor_store(fname)
+
+
+class tensor_store(object):
+
+    def __init__(self, fname):
+        """
+        Tensors saved by save_tensors. The eigen-decomposition, FA, MD and
+        color FA are computed lazily from the in-mask components, and
+        returned as full volumes (zero outside the mask).
+        """
+        with np.load(fname) as npz:
+            self.tensor = npz['tensor']
+            self.mask = npz['mask']
+            self.affine = npz['affine']
+        self._evals = None
+        self._evecs = None
+        self._fa = None
+
+    def volume(self, values):
+        """
+        Places in-mask values (one per voxel, or one row per voxel) into a
+        zero full volume.
+        """
+        values = np.asarray(values)
+        vol = np.zeros(self.mask.shape + values.shape[1:], dtype=values.dtype)
+        vol[self.mask] = values
+        return vol
+
+    def _eig(self):
+        if self._evals is None:
+            D = np.zeros((len(self.tensor), 3, 3))
+            D[:, lower[0], lower[1]] = self.tensor
+            D[:, lower[1], lower[0]] = self.tensor
+            evals, evecs = np.linalg.eigh(D)
+            # Decreasing order, eigenvectors in columns, as in dipy
+            self._evals = evals[:, ::-1]
+            self._evecs = evecs[:, :, ::-1]
+        return self._evals, self._evecs
+
+    @property
+    def evals(self):
+        return self._eig()[0]
+
+    @property
+    def evecs(self):
+        return self._eig()[1]
+
+    def _fa_values(self):
+        if self._fa is None:
+            ev = self.evals
+            num = (ev[:, 0] - ev[:, 1])**2 + (ev[:, 1] - ev[:, 2])**2 + \
+                (ev[:, 2] - ev[:, 0])**2
+            den = (ev**2).sum(axis=1)
+            fa = np.zeros(len(ev))
+            ok = den > 0
+            fa[ok] = np.sqrt(0.5 * num[ok] / den[ok])
+            self._fa = fa
+        return self._fa
+
+    @property
+    def fa(self):
+        return self.volume(self._fa_values().astype(np.float32))
+
+    @property
+    def md(self):
+        return self.volume(self.evals.mean(axis=1).astype(np.float32))
+
+    @property
+    def color_fa(self):
+        fa = np.clip(self._fa_values(), 0, 1)
+        rgb = np.abs(self.evecs[:, :, 0]) * fa[:, None]
+        return self.volume(rgb.astype(np.float32))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# atlas_bundle.py
+
+from ndmg.graph.label_cache import compact_labels, label_atlas
+
+import numpy as np
+import nibabel as nb
+import struct
+import json
+import os
+import os.path as op
+
+# Layout of a bundle file:
+#   magic                     - 8 bytes
+#   arrays                    - raw C-order arrays, each starting on a page
+#                               boundary so that they can be memory-mapped
+#   index                     - JSON: per parcellation its source file,
+#                               affine and the offsets of its label volume,
+#                               node IDs and voxel counts
+#   index offset              - 8 bytes, little-endian
+magic = b'NDMGATL1'
+align = 4096
+
+
+def default_bundle(atlas_dir, dwi=True):
+    """
+    Where the compiled bundle of an atlas directory is kept.
+    """
+    return op.join(atlas_dir, 'atlases.bundle' if dwi else
+                   'atlases-fmri.bundle')
+
+
+def _write_array(of, arr):
+    pad = -of.tell() % align
+    of.write(b'\0' * pad)
+    arr = np.ascontiguousarray(arr)
+    desc = {'offset': of.tell(), 'dtype': arr.dtype.str,
+            'shape': list(arr.shape)}
+    of.write(arr.tobytes())
+    return desc
+
+
+def compile_bundle(labels, outf):
+    """
+    Converts parcellations into one uncompressed bundle file. They are
+    stored in their compact label dtype, with their sorted node IDs and
+    voxel counts. The bundle is written to a temporary
+    file and renamed into place, so readers never see a partial one.
+
+    **Positional Arguments:**
+
+            labels:
+                - Nifti files of the parcellations
+            outf:
+                - Bundle file to write
+    """
+    index = []
+    tmpf = outf + '.tmp{}'.format(os.getpid())
+    with open(tmpf, 'wb') as of:
+        of.write(magic)
+        for path in labels:
+            print("Adding {}".format(path))
+            img = nb.load(path)
+            atlas = compact_labels(np.asanyarray(img.dataobj))
+            entry = {'source': op.abspath(path),
+                     'mtime': op.getmtime(path),
+                     'affine': np.asarray(img.affine).tolist(),
+                     'data': _write_array(of, atlas.data),
+                     'ids': _write_array(of, atlas.ids),
+                     'counts': _write_array(of, atlas.counts)}
+            index += [entry]
+        start = of.tell()
+        of.write(json.dumps(index).encode('utf-8'))
+        of.write(struct.pack('<Q', start))
+    os.rename(tmpf, outf)
+
+
+def load_bundle(path):
+    return atlas_bundle(path)
+
+
+class atlas_bundle(object):
+
+    def __init__(self, path):
+        """
+        A compiled atlas bundle. Volumes are memory-mapped read-only, so
+        reads are zero-copy and share the page cache with every other
+        process mapping the same bundle.
+        """
+        self.path = path
+        with open(path, 'rb') as inf:
+            if inf.read(len(magic)) != magic:
+                raise ValueError("Not an atlas bundle: {}".format(path))
+            inf.seek(-8, os.SEEK_END)
+            end = inf.tell()
+            start = struct.unpack('<Q', inf.read(8))[0]
+            inf.seek(start)
+            index = json.loads(inf.read(end - start).decode('utf-8'))
+        self.entries = dict((entry['source'], entry) for entry in index)
+
+    def _array(self, desc):
+        return np.memmap(self.path, dtype=np.dtype(desc['dtype']), mode='r',
+                         offset=desc['offset'], shape=tuple(desc['shape']))
+
+    def entry(self, path):
+        """
+        Index entry of a source file, or None if it is not in the bundle or
+        the file has changed since the bundle was compiled.
+        """
+        entry = self.entries.get(op.abspath(path))
+        if entry is None:
+            return None
+        if op.exists(path) and op.getmtime(path) != entry['mtime']:
+            return None
+        return entry
+
+    def labels(self, path):
+        """
+        label_atlas of a parcellation, or None if it is not in the bundle.
+        """
+        entry = self.entry(path)
+        if entry is None or 'ids' not in entry:
+            return None
+        return label_atlas(self._array(entry['data']),
+                           np.array(entry['affine']),
+                           np.array(self._array(entry['ids'])),
+                           np.array(self._array(entry['counts'])))
@@ -24,6 +24,7 @@ import os.path as op
 import os
 import sys
 import boto3
+import json
 from glob import glob
 
 def crawl_bids_directory(inDir, subjs, sesh):
@@ -85,6 +86,29 @@ def crawl_bids_directory(inDir, subjs, sesh):
     return (anat, func, dwi, bvec, bval)
 
 
+def get_array_sessions(session_list, index=None, client=None):
+    """
+    Given a session list written by `ndmg_cloud --array` (a local path or an
+    s3:// URI) returns the (participant, session) pairs for this array child.
+    The index defaults to `AWS_BATCH_JOB_ARRAY_INDEX`, or 0 outside an array.
+    """
+    if index is None:
+        index = int(os.getenv("AWS_BATCH_JOB_ARRAY_INDEX", 0))
+    if session_list.startswith('s3://'):
+        if client is None:
+            client = boto3.client('s3')
+        bucket, key = session_list[len('s3://'):].split('/', 1)
+        obj = client.get_object(Bucket=bucket, Key=key)
+        sessions = json.loads(obj['Body'].read())
+    else:
+        with open(session_list, 'r') as inf:
+            sessions = json.load(inf)
+    entry = sessions[index]
+    if isinstance(entry, dict):
+        entry = [entry]
+    return [(e['participant_label'], e['session_label']) for e in entry]
+
+
 def s3_get_data(bucket, remote, local, public=True):
     """
     Given an s3 bucket, data location on the bucket, and a download location,
@@ -106,7 +130,8 @@ def s3_get_data(bucket, remote, local, public=True):
 
 
 def s3_push_data(bucket, remote, outDir, modifier, creds=True):
-        cmd = 'aws s3 cp --exclude "tmp/*" {} s3://{}/{}/{} --recursive --acl public-read'
+        # Metric stores of group analysis are local caches, not results
+        cmd = 'aws s3 cp --exclude "tmp/*" --exclude "*/store/*" {} s3://{}/{}/{} --recursive --acl public-read'
         cmd = cmd.format(outDir, bucket, remote, modifier)
         if not creds:
             print("Note: no credentials provided, may fail to push big files.")
@@ -22,14 +22,105 @@
 from __future__ import print_function
 
 from collections import OrderedDict
+from multiprocessing import Pool
 
-import networkx as nx
+import pickle
+import bz2
+import gzip
 import os
 
+extensions = {'.graphml': 'graphml', '.xml': 'graphml',
+              '.gpickle': 'gpickle', '.pkl': 'gpickle', '.pickle': 'gpickle',
+              '.edgelist': 'edgelist', '.ssv': 'edgelist',
+              '.txt': 'edgelist', '.csv': 'csv'}
+compressions = {'.gz': gzip.open, '.bz2': bz2.BZ2File}
 
-def loadGraphs(filenames, verb=False):
+
+def _open(path):
+    """
+    Opens a (possibly gzip or bz2 compressed) graph file for binary reading.
+    """
+    opener = compressions.get(os.path.splitext(path)[1].lower(), open)
+    return opener(path, 'rb')
+
+
+def graph_format(path):
+    """
+    Determines the format of a graph file, from its extension if it is a
+    known one or else from its first bytes. Returns one of 'graphml',
+    'gpickle', 'edgelist' (whitespace separated) and 'csv' (a comma
+    separated edgelist).
+
+    Required parameters:
+        path:
+            - Graph filename
+    """
+    base, ext = os.path.splitext(path.lower())
+    if ext in compressions:
+        ext = os.path.splitext(base)[1]
+    if ext in extensions:
+        return extensions[ext]
+    with _open(path) as inf:
+        head = inf.read(512).lstrip()
+    if head.startswith(b'\x80') or head.startswith(b'(dp') or \
+            head.startswith(b'ccopy_reg') or head.startswith(b'cnetworkx'):
+        return 'gpickle'
+    if head.startswith(b'<?xml') or head.startswith(b'<graphml'):
+        return 'graphml'
+    return 'edgelist'
+
+
+def read_graph(path, fmt=None):
+    """
+    Reads a graph with the reader for its format.
+
+    Required parameters:
+        path:
+            - Graph filename
+    Optional parameters:
+        fmt:
+            - Format of the file (sniffed with graph_format by default)
+    """
+    import networkx as nx  # deferred so `import ndmg.utils` stays light
+
+    if fmt is None:
+        fmt = graph_format(path)
+    if fmt == 'graphml':
+        return nx.read_graphml(path)
+    if fmt == 'gpickle':
+        with _open(path) as inf:
+            return pickle.load(inf)
+    if fmt == 'edgelist':
+        return nx.read_weighted_edgelist(path)
+    if fmt == 'csv':
+        return nx.read_weighted_edgelist(path, delimiter=',')
+    raise ValueError("Unknown graph format: " + str(fmt))
+
+
+def compact_graph(g):
+    """
+    Compact array form of a graph: its node labels and symmetric sparse (CSR)
+    weighted adjacency matrix in that node order.
+    """
+    from ndmg.stats.graph_stack import sparse_adjacency
+
+    nodes = list(g.nodes())
+    return nodes, sparse_adjacency(g, nodes)
+
+
+def _load(args):
+    path, compact = args
+    g = read_graph(path)
+    return compact_graph(g) if compact else g
+
+
+def loadGraphs(filenames, verb=False, nproc=None, progress=None,
+               compact=False):
     """
-    Given a list of files, returns a dictionary of graphs
+    Given a list of files, returns a dictionary of graphs, keyed by filename.
+
+    Each file is read directly with the reader for its format (see
+    graph_format), and files are read in a process pool.
 
     Required parameters:
         filenames:
@@ -37,21 +128,37 @@ def loadGraphs(filenames, verb=False):
     Optional parameters:
         verb:
             - Toggles verbose output statements
+        nproc:
+            - Number of worker processes (defaults to the number of CPUs)
+        progress:
+            - Function called as progress(done, total, filename) after each
+              file is loaded
+        compact:
+            - Return each graph as (nodes, sparse adjacency) (see
+              compact_graph) instead of a networkx graph
     """
-    #  Initializes empty dictionary
     if type(filenames) is not list:
         filenames = [filenames]
+    args = [(files, compact) for files in filenames]
+    if nproc == 1 or len(args) < 2:
+        pool = None
+        loaded = (_load(a) for a in args)
+    else:
+        pool = Pool(nproc)
+        loaded = pool.imap(_load, args)
+
+    #  Adds graphs to dictionary with key being filename
     gstruct = OrderedDict()
-    for idx, files in enumerate(filenames):
-        if verb:
-            print("Loading: " + files)
-        #  Adds graphs to dictionary with key being filename
-        fname = os.path.basename(files)
-        try:
-            gstruct[fname] = nx.read_weighted_edgelist(files) 
-        except:
-            try:
-                gstruct[fname] = nx.read_gpickle(files)
-            except:
-                gstruct[fname] = nx.read_graphml(files)
+    try:
+        for idx, g in enumerate(loaded):
+            files = filenames[idx]
+            if verb:
+                print("Loaded: " + files)
+            gstruct[os.path.basename(files)] = g
+            if progress is not None:
+                progress(idx + 1, len(filenames), files)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
     return gstruct
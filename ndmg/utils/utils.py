@@ -21,8 +21,6 @@
 
 from __future__ import print_function
 
-from dipy.io import read_bvals_bvecs
-from dipy.core.gradients import gradient_table
 from subprocess import Popen, PIPE
 import numpy as np
 import nibabel as nb
@@ -53,6 +51,8 @@ def load_bval_bvec_dwi(fbval, fbvec, dwi_file, dwi_file_out):
 
     **Positional Arguments:**
     """
+    from dipy.io import read_bvals_bvecs
+    from dipy.core.gradients import gradient_table
 
     # Load Data
     img = nb.load(dwi_file)
@@ -85,6 +85,8 @@ def load_bval_bvec(fbval, fbvec):
 
     **Positional Arguments:**
     """
+    from dipy.io import read_bvals_bvecs
+    from dipy.core.gradients import gradient_table
 
     bvals, bvecs = read_bvals_bvecs(fbval, fbvec)
     gtab = gradient_table(bvals, bvecs, atol=0.01)
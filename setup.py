@@ -22,7 +22,8 @@ setup(
         'console_scripts': [
             'ndmg_dwi_pipeline=ndmg.scripts.ndmg_dwi_pipeline:main',
             'ndmg_bids=ndmg.scripts.ndmg_bids:main',
-            'ndmg_cloud=ndmg.scripts.ndmg_cloud:main'
+            'ndmg_cloud=ndmg.scripts.ndmg_cloud:main',
+            'ndmg_atlas_compile=ndmg.scripts.ndmg_atlas_compile:main'
     ]
     },
     version=VERSION,
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_atlas_bundle.py
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import nibabel as nb
+import os.path as op
+
+from ndmg.utils.atlas_bundle import compile_bundle, load_bundle
+from ndmg.graph import label_cache
+
+
+class atlas_bundle_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.zeros((6, 5, 4), dtype=np.float32)
+        self.data[1:3, :, :] = 3
+        self.data[4, 2, 1] = 300
+        self.label = op.join(self.tmpdir, 'labels.nii.gz')
+        nb.save(nb.Nifti1Image(self.data, np.diag([2, 2, 2, 1])), self.label)
+        self.bundle = op.join(self.tmpdir, 'atlases.bundle')
+        compile_bundle([self.label], self.bundle)
+        label_cache.clear_labels()
+
+    def tearDown(self):
+        label_cache.clear_labels()
+        shutil.rmtree(self.tmpdir)
+
+    def test_labels(self):
+        self.assertTrue(label_cache.use_bundle(load_bundle(self.bundle)))
+        atlas = label_cache.load_labels(self.label)
+        self.assertIsInstance(atlas.data, np.memmap)
+        self.assertEqual(atlas.data.dtype, np.uint16)
+        np.testing.assert_array_equal(atlas.data, self.data)
+        self.assertEqual(atlas.ids.tolist(), [3, 300])
+        self.assertEqual(atlas.counts.tolist(), [40, 1])
+
+    def test_register_once(self):
+        for _ in range(3):
+            label_cache.use_bundle(load_bundle(self.bundle))
+        self.assertEqual(len(label_cache._bundles), 1)
+        self.assertFalse(label_cache.use_bundle(load_bundle(self.bundle)))
+
+
+if __name__ == '__main__':
+    unittest.main()
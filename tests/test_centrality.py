@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_centrality.py
+
+import unittest
+import numpy as np
+import networkx as nx
+
+from ndmg.stats.centrality import betweenness_centralities
+
+
+def random_graph(n, p, seed):
+    """
+    Random weighted graph with a few self-loops.
+    """
+    rng = np.random.RandomState(seed)
+    g = nx.gnp_random_graph(n, p, seed=seed)
+    for u, v in g.edges():
+        g[u][v]['weight'] = rng.randint(1, 100)
+    for u in rng.choice(n, n // 5, replace=False):
+        g.add_edge(u, u, weight=rng.randint(1, 100))
+    return g
+
+
+class betweenness_test(unittest.TestCase):
+    def setUp(self):
+        self.graphs = dict(('g{}'.format(s), random_graph(60, p, s))
+                           for s, p in enumerate([0.03, 0.1, 0.4]))
+
+    def test_exact(self):
+        bc, errs = betweenness_centralities(self.graphs, nproc=1)
+        for key, g in self.graphs.items():
+            expected = nx.betweenness_centrality(g)
+            np.testing.assert_allclose(bc[key], [expected[n]
+                                                 for n in g.nodes()],
+                                       atol=1e-12)
+            self.assertEqual(np.max(errs[key]), 0)
+
+    def test_exact_pool(self):
+        serial, _ = betweenness_centralities(self.graphs, nproc=1)
+        pooled, _ = betweenness_centralities(self.graphs, nproc=2)
+        for key in self.graphs:
+            np.testing.assert_allclose(serial[key], pooled[key], atol=1e-12)
+
+    def test_sampled(self):
+        bc, errs = betweenness_centralities(self.graphs, k=30, nproc=1)
+        for key, g in self.graphs.items():
+            expected = nx.betweenness_centrality(g)
+            expected = np.array([expected[n] for n in g.nodes()])
+            # Nearly all nodes within a few standard errors of the exact value
+            within = np.abs(bc[key] - expected) <= 4*errs[key] + 1e-12
+            self.assertGreaterEqual(np.mean(within), 0.95)
+
+
+if __name__ == '__main__':
+    unittest.main()
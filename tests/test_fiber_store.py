@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_fiber_store.py
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import os.path as op
+
+from ndmg.track.fiber_store import save_fibers, load_fibers, compact_fibers
+
+
+class fiber_store_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.RandomState(12345)
+        self.fibers = [rng.rand(n, 3).astype(np.float32)
+                       for n in [5, 1, 12, 3]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertFibers(self, fibers):
+        self.assertEqual(len(fibers), len(self.fibers))
+        for f, expected in zip(fibers, self.fibers):
+            np.testing.assert_array_equal(f, expected)
+
+    def test_round_trip(self):
+        fname = op.join(self.tmpdir, 'sub-1_fibers.npz')
+        save_fibers(fname, self.fibers)
+        fibers = load_fibers(fname)
+        self.assertIsInstance(fibers.points, np.memmap)
+        self.assertFibers(fibers)
+        self.assertEqual(compact_fibers(fname, self.tmpdir), fname)
+
+    def test_compact_old_format(self):
+        fname = op.join(self.tmpdir, 'sub-1_fibers.npz')
+        old = np.empty(len(self.fibers), dtype=object)
+        old[:] = self.fibers
+        np.savez(fname, old)
+        convdir = op.join(self.tmpdir, 'converted')
+        outf = compact_fibers(fname, convdir)
+        self.assertEqual(outf, op.join(convdir, 'sub-1_fibers.npz'))
+        fibers = load_fibers(outf)
+        self.assertIsInstance(fibers.points, np.memmap)
+        self.assertFibers(fibers)
+        self.assertEqual(compact_fibers(fname, convdir), outf)
+
+
+if __name__ == '__main__':
+    unittest.main()
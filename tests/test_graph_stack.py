@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_graph_stack.py
+
+import unittest
+import numpy as np
+import networkx as nx
+
+from ndmg.stats.graph_stack import *
+
+
+def random_graph(n, p, seed):
+    """
+    Random weighted graph over a subset of n nodes with a few self-loops.
+    """
+    rng = np.random.RandomState(seed)
+    g = nx.Graph()
+    keep = rng.permutation(n)[:n - n // 10] + 1
+    g.add_nodes_from(keep)
+    for u, v in nx.gnp_random_graph(n, p, seed=seed).edges():
+        if u + 1 in g and v + 1 in g:
+            g.add_edge(u + 1, v + 1, weight=rng.randint(0, 100))
+    for u in rng.choice(keep, n // 5, replace=False):
+        g.add_edge(u, u, weight=rng.randint(1, 100))
+    return g
+
+
+class graph_stack_test(unittest.TestCase):
+    def setUp(self):
+        self.graphs = dict(('g{}'.format(s), random_graph(50, p, s))
+                           for s, p in enumerate([0.05, 0.2, 0.6]))
+        self.nodes = node_order(self.graphs)
+
+    def test_stack(self):
+        subjs = sorted(self.graphs.keys())
+        A, E = stack_graphs(self.graphs, subjs, self.nodes)
+        self.assertEqual(E.dtype, bool)
+        nnz = number_non_zeros(E)
+        degs = degrees(E)
+        cc = clustering(E)
+        for s, subj in enumerate(subjs):
+            g = self.graphs[subj]
+            idx = subject_index(g, self.nodes)
+            self.assertEqual(nnz[s], g.number_of_edges())
+            self.assertEqual(degs[s, idx].tolist(),
+                             [g.degree(n) for n in g.nodes()])
+            expected = nx.clustering(g)
+            np.testing.assert_allclose(cc[s, idx],
+                                       [expected[n] for n in g.nodes()])
+
+    def test_chunks(self):
+        N = len(self.nodes)
+        sizes = [len(subjs) for subjs, A, E in
+                 iter_stacks(self.graphs, self.nodes,
+                             2 * stack_cell_bytes * N**2)]
+        self.assertEqual(sizes, [2, 1])
+
+    def test_sparse(self):
+        subjs = sorted(self.graphs.keys())
+        A, E = stack_graphs(self.graphs, subjs, self.nodes)
+        halves = np.zeros(E.shape[:2])
+        idxs = [subject_index(self.graphs[subj], self.nodes)
+                for subj in subjs]
+        for s, idx in enumerate(idxs):
+            halves[s, idx[len(idx)//2:]] = 1
+        nnz = number_non_zeros(E)
+        degs = degrees(E)
+        ipso, contra = hemisphere_degrees(E, halves)
+        cc = clustering(E)
+        for s, subj in enumerate(subjs):
+            idx = idxs[s]
+            metrics = sparse_metrics(self.graphs[subj])
+            self.assertEqual(metrics[0], nnz[s])
+            self.assertEqual(metrics[1].tolist(), degs[s, idx].tolist())
+            self.assertEqual(metrics[2].tolist(), ipso[s, idx].tolist())
+            self.assertEqual(metrics[3].tolist(), contra[s, idx].tolist())
+            self.assertEqual(metrics[4].tolist(),
+                             edge_weights(A, E, s, idx).tolist())
+            np.testing.assert_allclose(metrics[5], cc[s, idx])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_kde.py
+
+import unittest
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from ndmg.stats import kde
+from ndmg.stats.kde import binned_kde
+
+
+def exact_kde(d):
+    raise AssertionError("binned path not used")
+
+
+class binned_kde_test(unittest.TestCase):
+    def binned(self, data, points):
+        """
+        binned_kde, failing if any sample falls back to gaussian_kde.
+        """
+        kde.gaussian_kde = exact_kde
+        try:
+            return binned_kde(data, points)
+        finally:
+            kde.gaussian_kde = gaussian_kde
+
+    def assertBound(self, data):
+        points = [np.linspace(0, np.max(d), 500) for d in data]
+        for d, p, f in zip(data, points, self.binned(data, points)):
+            exact = gaussian_kde(d)(p)
+            self.assertLessEqual(np.max(np.abs(f - exact)),
+                                 1e-3 * np.max(exact))
+
+    def test_heavy_tails(self):
+        rng = np.random.RandomState(12345)
+        self.assertBound([np.round(rng.pareto(a, 20000) * 10)
+                          for a in [1.5, 2, 3, 5]])
+
+    def test_large_heavy_tails(self):
+        # Shaped like fiber counts of edges
+        rng = np.random.RandomState(12345)
+        self.assertBound([np.round(rng.lognormal(2, 1.5, 200000))])
+
+    def test_scales(self):
+        rng = np.random.RandomState(12345)
+        self.assertBound([rng.rand(5000) * 0.01, rng.rand(5000) * 1000,
+                          rng.lognormal(0, 1, 5000),
+                          rng.randint(0, 5, 2000).astype(float)])
+
+    def test_exact_fallback(self):
+        rng = np.random.RandomState(12345)
+        d = np.append(rng.normal(0, 1, 1000), 1e9)
+        p = np.linspace(-3, 3, 50)
+        f = binned_kde([d], [p])[0]
+        np.testing.assert_allclose(f, gaussian_kde(d)(p))
+
+    def test_constant(self):
+        points = [np.linspace(0, 2, 5)]
+        f = binned_kde([np.ones(10)], points)[0]
+        self.assertEqual(np.argmax(f), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
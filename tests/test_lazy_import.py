@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_lazy_import.py
+
+from subprocess import Popen, PIPE
+
+import unittest
+import json
+import sys
+import os.path as op
+
+root = op.dirname(op.dirname(op.abspath(__file__)))
+
+
+def run(code):
+    """
+    Runs python code in a fresh interpreter and returns its json output.
+    """
+    p = Popen([sys.executable, '-c', code], stdout=PIPE, stderr=PIPE,
+              cwd=root)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise AssertionError(err.decode('utf-8'))
+    return json.loads(out.decode('utf-8'))
+
+
+class LazyImportTest(unittest.TestCase):
+
+    def test_import_is_light(self):
+        loaded = run("import sys, json, ndmg\n"
+                     "print(json.dumps([m for m in ['networkx', 'nibabel', "
+                     "'dipy'] if m in sys.modules]))")
+        self.assertEqual(loaded, [])
+
+    def test_graph_class(self):
+        name = run("import json\n"
+                   "import ndmg.graph as mgg\n"
+                   "print(json.dumps([type(mgg).__name__, mgg.__name__]))")
+        self.assertEqual(name, ['type', 'graph'])
+
+
+if __name__ == '__main__':
+    unittest.main()
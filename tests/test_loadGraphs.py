@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_loadGraphs.py
+
+import unittest
+import tempfile
+import shutil
+import gzip
+import os.path as op
+
+from ndmg.utils.loadGraphs import graph_format, read_graph
+
+
+class read_graph_test(unittest.TestCase):
+    edges = [('1', '2', 3.0), ('2', '5', 1.5), ('4', '4', 2.0)]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, sep, opener=open):
+        fname = op.join(self.tmpdir, name)
+        with opener(fname, 'wb') as of:
+            for u, v, w in self.edges:
+                of.write(sep.join([u, v, str(w)]).encode('utf-8') + b'\n')
+        return fname
+
+    def assertEdges(self, g):
+        self.assertEqual(sorted((min(u, v), max(u, v), d['weight'])
+                                for u, v, d in g.edges(data=True)),
+                         sorted(self.edges))
+
+    def test_edgelist(self):
+        fname = self.write('sub-1_graph.edgelist', ' ')
+        self.assertEqual(graph_format(fname), 'edgelist')
+        self.assertEdges(read_graph(fname))
+
+    def test_csv(self):
+        fname = self.write('sub-1_graph.csv', ',')
+        self.assertEqual(graph_format(fname), 'csv')
+        self.assertEdges(read_graph(fname))
+
+    def test_compressed_csv(self):
+        fname = self.write('sub-1_graph.csv.gz', ',', gzip.open)
+        self.assertEqual(graph_format(fname), 'csv')
+        self.assertEdges(read_graph(fname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_metric_io.py
+
+from collections import OrderedDict
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import os.path as op
+
+from ndmg.stats.metric_io import write_metric, read_metric, is_metric
+
+
+class metric_io_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def round_trip(self, metric, data, **kwargs):
+        path = op.join(self.tmpdir, 'atlas_' + metric)
+        write_metric(path, metric, data)
+        self.assertTrue(is_metric(path))
+        out = read_metric(path, **kwargs)
+        self.assertEqual(list(out.keys()), [metric])
+        return out[metric]
+
+    def test_scalar(self):
+        data = OrderedDict([('sub-1', 10), ('sub-2', 0), ('sub-3', 7)])
+        out = self.round_trip('number_non_zeros', data)
+        self.assertEqual(list(out.keys()), list(data.keys()))
+        self.assertEqual(dict(out), dict(data))
+
+    def test_ragged(self):
+        data = OrderedDict([('sub-1', [0.5, 1.0, 2.5]), ('sub-2', []),
+                            ('sub-3', np.arange(4.0))])
+        out = self.round_trip('edge_weight', data, mmap_mode=None)
+        self.assertEqual(list(out.keys()), list(data.keys()))
+        for subj in data:
+            np.testing.assert_array_equal(out[subj], data[subj])
+
+    def test_nested(self):
+        data = {'total_deg': OrderedDict([('sub-1', [2, 3]),
+                                          ('sub-2', [1, 1, 4])]),
+                'ipso_deg': OrderedDict([('sub-1', [1, 2]),
+                                         ('sub-2', [0, 1, 3])]),
+                'contra_deg': OrderedDict([('sub-1', [1, 1]),
+                                           ('sub-2', [1, 0, 1])])}
+        out = self.round_trip('degree_distribution', data)
+        self.assertEqual(sorted(out.keys()), sorted(data.keys()))
+        for field in data:
+            for subj in data[field]:
+                np.testing.assert_array_equal(out[field][subj],
+                                              data[field][subj])
+
+    def test_matrix(self):
+        data = np.arange(12.0).reshape(3, 4)
+        out = self.round_trip('study_mean_connectome', data)
+        self.assertIsInstance(out, np.memmap)
+        np.testing.assert_array_equal(out, data)
+
+    def test_subjects(self):
+        data = OrderedDict([('sub-1', [1.0]), ('sub-2', [2.0, 2.0]),
+                            ('sub-3', [3.0, 3.0, 3.0])])
+        out = self.round_trip('clustering_coefficients', data,
+                              subjects=['sub-3', 'sub-1'])
+        self.assertEqual(list(out.keys()), ['sub-3', 'sub-1'])
+        np.testing.assert_array_equal(out['sub-3'], [3.0, 3.0, 3.0])
+        np.testing.assert_array_equal(out['sub-1'], [1.0])
+
+        nested = {'total_deg': data, 'ipso_deg': data}
+        out = self.round_trip('degree_distribution', nested,
+                              subjects=['sub-2'])
+        for field in nested:
+            self.assertEqual(list(out[field].keys()), ['sub-2'])
+            np.testing.assert_array_equal(out[field]['sub-2'], [2.0, 2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_metric_store.py
+
+import unittest
+import numpy as np
+import networkx as nx
+
+from ndmg.stats.graph_stack import sparse_adjacency, sort_nodes
+from ndmg.stats.metric_store import load_index, update_moments, \
+    connectome_std
+
+
+def random_graph(nodes, p, rng):
+    """
+    Random graph over the given nodes, with large weights and self-loops.
+    """
+    g = nx.Graph()
+    g.add_nodes_from(nodes)
+    for i, u in enumerate(nodes):
+        for v in nodes[i:]:
+            if rng.rand() < p:
+                g.add_edge(u, v, weight=rng.randint(1, 1000))
+    return g
+
+
+def dense(g, nodes):
+    pos = dict((n, i) for i, n in enumerate(nodes))
+    A = np.zeros((len(nodes), len(nodes)))
+    for u, v, d in g.edges(data=True):
+        A[pos[u], pos[v]] = A[pos[v], pos[u]] = d['weight']
+    return A
+
+
+class moments_test(unittest.TestCase):
+    def update(self, index, g, sign=1):
+        nodes = list(g.nodes())
+        update_moments(index, nodes, sparse_adjacency(g, nodes), sign)
+
+    def assertMoments(self, index, graphs):
+        """
+        Compares the running moments with the mean and sample std of the
+        graphs as dense matrices over all nodes seen, absent ones being 0.
+        """
+        self.assertEqual(index['count'], len(graphs))
+        nodes = index['nodes']
+        self.assertEqual(nodes, sort_nodes(nodes))
+        stack = np.array([dense(g, nodes) for g in graphs])
+        np.testing.assert_allclose(index['mean'], stack.mean(axis=0),
+                                   rtol=1e-10, atol=1e-9)
+        np.testing.assert_allclose(connectome_std(index),
+                                   stack.std(axis=0, ddof=1),
+                                   rtol=1e-10, atol=1e-9)
+
+    def test_add_change_remove(self):
+        rng = np.random.RandomState(12345)
+        index = load_index('/nonexistent')
+        graphs = dict()
+        # Node sets differ, so the node axis grows as graphs are added
+        for s in range(12):
+            nodes = sorted(rng.choice(40, 25 + s, replace=False) + 1)
+            graphs[s] = random_graph(nodes, 0.3, rng)
+            self.update(index, graphs[s])
+        self.assertMoments(index, list(graphs.values()))
+
+        # A changed graph is removed, then added again
+        for s in [3, 7]:
+            self.update(index, graphs[s], sign=-1)
+            nodes = sorted(rng.choice(45, 30, replace=False) + 1)
+            graphs[s] = random_graph(nodes, 0.5, rng)
+            self.update(index, graphs[s])
+        self.assertMoments(index, list(graphs.values()))
+
+        for s in [0, 5, 6, 11, 2, 9, 10, 1]:
+            self.update(index, graphs.pop(s), sign=-1)
+            self.assertMoments(index, list(graphs.values()))
+
+        for s in list(graphs.keys()):
+            self.update(index, graphs.pop(s), sign=-1)
+        self.assertEqual(index['count'], 0)
+        self.assertEqual(np.abs(index['mean']).max(), 0)
+        self.assertEqual(np.abs(index['m2']).max(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_ndmg_cloud.py
+
+from copy import deepcopy
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+import os.path as op
+
+from ndmg.scripts import ndmg_cloud as cloud
+from ndmg.utils import bids
+
+root = op.dirname(op.dirname(op.abspath(__file__)))
+
+
+class paginator(object):
+    """
+    Mimics the `list_objects_v2` paginator, returning `page_size` keys (or
+    common prefixes) per page.
+    """
+    def __init__(self, objects, page_size, calls):
+        self.objects = objects
+        self.page_size = page_size
+        self.calls = calls
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        self.calls += [(Prefix, Delimiter)]
+        entries = list()
+        for key in sorted(self.objects.keys()):
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter is not None and Delimiter in rest:
+                prefix = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if ('CommonPrefixes', prefix) not in entries:
+                    entries += [('CommonPrefixes', prefix)]
+            else:
+                entries += [('Contents', key)]
+        for start in range(0, len(entries), self.page_size):
+            page = dict()
+            for kind, name in entries[start:start + self.page_size]:
+                if kind == 'CommonPrefixes':
+                    entry = {'Prefix': name}
+                else:
+                    entry = {'Key': name, 'Size': self.objects[name]}
+                page.setdefault(kind, []).append(entry)
+            yield page
+
+
+class s3_client(object):
+    def __init__(self, objects=None, page_size=2):
+        self.objects = dict(objects or {})
+        self.page_size = page_size
+        self.listings = list()
+
+    def get_paginator(self, name):
+        return paginator(self.objects, self.page_size, self.listings)
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects['{}/{}'.format(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        body = self.objects['{}/{}'.format(Bucket, Key)]
+
+        class stream(object):
+            def read(self):
+                return body
+        return {'Body': stream()}
+
+
+class batch_client(object):
+    def __init__(self, states=None):
+        self.submitted = list()
+        self.states = dict(states or {})
+        self.described = list()
+        self.cancelled = list()
+        self.terminated = list()
+
+    def submit_job(self, **kwargs):
+        self.submitted += [kwargs]
+        return {'jobName': kwargs['jobName'], 'jobId': str(len(self.submitted)),
+                'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def describe_jobs(self, jobs):
+        self.described.append(list(jobs))
+        return {'jobs': [{'jobId': jid, 'jobName': 'job-' + jid,
+                          'status': self.states[jid]} for jid in jobs]}
+
+    def cancel_job(self, jobId, reason):
+        self.cancelled.append(jobId)
+
+    def terminate_job(self, jobId, reason):
+        self.terminated.append(jobId)
+
+
+dataset = {'data/dataset_description.json': 10,
+           'data/sub-01/ses-1/dwi/sub-01_ses-1_dwi.nii.gz': 2*1024**2,
+           'data/sub-01/ses-1/anat/sub-01_ses-1_T1w.nii.gz': 1024**2,
+           'data/sub-01/ses-2/dwi/sub-01_ses-2_dwi.nii.gz': 3*1024**2,
+           'data/sub-01/sub-01_dwi.bval': 100,
+           'data/sub-02/dwi/sub-02_dwi.nii.gz': 5*1024**2,
+           'data/sub-03/ses-a/dwi/sub-03_ses-a_dwi.nii.gz': 1024**2,
+           'data/sub-03/ses-b/dwi/sub-03_ses-b_dwi.nii.gz': 1024**2,
+           'data/sub-03/ses-c/dwi/sub-03_ses-c_dwi.nii.gz': 1024**2,
+           'data/graphs/desikan/sub-01_ses-1_desikan.gpickle': 100,
+           'data/graphs/JHU/sub-01_ses-1_JHU.gpickle': 100}
+
+
+class crawl_bucket_test(unittest.TestCase):
+    def test_sessions(self):
+        client = s3_client(dataset)
+        seshs = cloud.crawl_bucket('bkt', 'data', client=client, workers=2)
+        self.assertEqual(list(seshs.keys()), ['01', '02', '03'])
+        self.assertEqual(seshs['01'], ['1', '2'])
+        self.assertEqual(seshs['02'], [None])
+        self.assertEqual(seshs['03'], ['a', 'b', 'c'])
+        # Without sizes only the session prefixes are listed
+        self.assertEqual(set(d for p, d in client.listings), set(['/']))
+
+    def test_sizes(self):
+        client = s3_client(dataset, page_size=1)
+        seshs, nbytes = cloud.crawl_bucket('bkt', 'data', client=client,
+                                           sizes=True)
+        self.assertEqual(seshs['03'], ['a', 'b', 'c'])
+        # Files above the session level count towards every session
+        self.assertEqual(nbytes[('01', '1')], 3*1024**2 + 100)
+        self.assertEqual(nbytes[('01', '2')], 3*1024**2 + 100)
+        self.assertEqual(nbytes[('02', None)], 5*1024**2)
+        self.assertEqual(len(nbytes), 6)
+
+    def test_group(self):
+        client = s3_client(dataset, page_size=1)
+        atlases = cloud.crawl_bucket('bkt', 'data', group=True, client=client)
+        self.assertEqual(sorted(atlases), ['JHU', 'desikan'])
+
+    def test_pack(self):
+        nbytes = {('01', '1'): 1024**2, ('01', '2'): 1024**2,
+                  ('02', None): 4*1024**2}
+        bins = cloud.pack_sessions(nbytes, 300, overhead=100, rate=50)
+        self.assertEqual(sorted(len(b) for b in bins), [1, 2])
+
+
+class array_job_test(unittest.TestCase):
+    def setUp(self):
+        self.jobdir = tempfile.mkdtemp()
+        os.makedirs(op.join(self.jobdir, 'jobs'))
+        os.makedirs(op.join(self.jobdir, 'ids'))
+        templ = op.join(root, 'templates', 'ndmg_cloud_participant.json')
+        with open(templ, 'r') as inf:
+            self.template = json.load(inf)
+
+    def tearDown(self):
+        shutil.rmtree(self.jobdir)
+
+    def create(self, seshs, **kwargs):
+        client = s3_client()
+        jobs = cloud.create_array_json('bkt', 'data', seshs,
+                                       deepcopy(self.template), self.jobdir,
+                                       client=client, **kwargs)
+        jsons = list()
+        for job in jobs:
+            with open(job, 'r') as inf:
+                jsons += [json.load(inf)]
+        return client, jsons
+
+    def test_command(self):
+        seshs = {'01': ['1', '2'], '02': [None]}
+        client, jsons = self.create(seshs, debug=True)
+        self.assertEqual(len(jsons), 1)
+        cmd = self.template['containerOverrides']['command']
+        key = 'data/ndmg_jobs/{}_sessions.json'.format(jsons[0]['jobName'])
+        self.assertEqual(jsons[0]['containerOverrides']['command'],
+                         cmd[:7] + ['--session_list', 's3://bkt/' + key] +
+                         cmd[9:] + ['--debug'])
+        self.assertEqual(jsons[0]['arrayProperties'], {'size': 3})
+        sessions = json.loads(client.objects['bkt/' + key])
+        self.assertEqual(len(sessions), 3)
+
+    def test_single_child(self):
+        client, jsons = self.create({'01': ['1']})
+        self.assertNotIn('arrayProperties', jsons[0])
+
+    def test_bins(self):
+        bins = [[('01', '1'), ('01', '2')], [('02', None)]]
+        client, jsons = self.create(None, bins=bins)
+        self.assertEqual(jsons[0]['arrayProperties'], {'size': 2})
+        name = jsons[0]['jobName']
+        with open(op.join(self.jobdir, 'jobs', name + '_sessions.json')) as f:
+            sessions = json.load(f)
+        self.assertEqual([len(s) for s in sessions], [2, 1])
+
+    def test_submit(self):
+        client, jsons = self.create({'01': ['1', '2']})
+        batch = batch_client()
+        jobs = [op.join(self.jobdir, 'jobs', jsons[0]['jobName'] + '.json')]
+        cloud.submit_jobs(jobs, self.jobdir, client=batch)
+        self.assertEqual(len(batch.submitted), 1)
+        self.assertEqual(batch.submitted[0]['arrayProperties'], {'size': 2})
+        ids = op.join(self.jobdir, 'ids', jsons[0]['jobName'] + '.json')
+        with open(ids, 'r') as inf:
+            submission = json.load(inf)
+        self.assertEqual(submission['jobId'], '1')
+        self.assertNotIn('ResponseMetadata', submission)
+
+
+class status_test(unittest.TestCase):
+    def setUp(self):
+        self.jobdir = tempfile.mkdtemp()
+        os.makedirs(op.join(self.jobdir, 'ids'))
+        self.states = dict()
+        for i in range(210):
+            jid = str(i)
+            self.states[jid] = cloud.all_states[i % len(cloud.all_states)]
+            with open(op.join(self.jobdir, 'ids', 'job-{}.json'.format(jid)),
+                      'w') as outfile:
+                json.dump({'jobName': 'job-' + jid, 'jobId': jid}, outfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.jobdir)
+
+    def test_batches(self):
+        client = batch_client(self.states)
+        states = cloud.refresh_status(self.jobdir, client)
+        self.assertEqual(len(states), 210)
+        self.assertEqual([len(ids) for ids in client.described],
+                         [100, 100, 10])
+        self.assertEqual(sorted(sum(client.described, [])),
+                         sorted(self.states.keys()))
+
+    def test_cache(self):
+        client = batch_client(self.states)
+        cloud.refresh_status(self.jobdir, client)
+        client.described = list()
+        states = cloud.refresh_status(self.jobdir, client)
+        requeried = sum(client.described, [])
+        running = [jid for jid, status in self.states.items()
+                   if status not in cloud.done_states]
+        self.assertEqual(sorted(requeried), sorted(running))
+        self.assertTrue(all(len(ids) <= 100 for ids in client.described))
+        self.assertEqual(dict((jid, state['status'])
+                              for jid, state in states.items()), self.states)
+
+    def test_kill(self):
+        client = batch_client(self.states)
+        cloud.kill_jobs(self.jobdir, client=client)
+
+        def having(statuses):
+            return sorted(jid for jid, status in self.states.items()
+                          if status in statuses)
+        self.assertEqual(sorted(client.cancelled),
+                         having(['SUBMITTED', 'PENDING', 'RUNNABLE']))
+        self.assertEqual(sorted(client.terminated),
+                         having(['STARTING', 'RUNNING']))
+
+
+class array_sessions_test(unittest.TestCase):
+    sessions = [[{'participant_label': '01', 'session_label': '1'},
+                 {'participant_label': '01', 'session_label': '2'}],
+                {'participant_label': '02', 'session_label': None}]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = os.environ.pop('AWS_BATCH_JOB_ARRAY_INDEX', None)
+        self.session_list = op.join(self.tmpdir, 'sessions.json')
+        with open(self.session_list, 'w') as outfile:
+            json.dump(self.sessions, outfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        os.environ.pop('AWS_BATCH_JOB_ARRAY_INDEX', None)
+        if self.index is not None:
+            os.environ['AWS_BATCH_JOB_ARRAY_INDEX'] = self.index
+
+    def test_default_index(self):
+        self.assertEqual(bids.get_array_sessions(self.session_list),
+                         [('01', '1'), ('01', '2')])
+
+    def test_environment_index(self):
+        os.environ['AWS_BATCH_JOB_ARRAY_INDEX'] = '1'
+        self.assertEqual(bids.get_array_sessions(self.session_list),
+                         [('02', None)])
+        self.assertEqual(bids.get_array_sessions(self.session_list, 0),
+                         [('01', '1'), ('01', '2')])
+
+    def test_s3(self):
+        client = s3_client()
+        client.put_object('bkt', 'data/sessions.json',
+                          json.dumps(self.sessions))
+        os.environ['AWS_BATCH_JOB_ARRAY_INDEX'] = '1'
+        self.assertEqual(bids.get_array_sessions('s3://bkt/data/sessions.json',
+                                                 client=client),
+                         [('02', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
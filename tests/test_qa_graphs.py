@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Copyright 2016 NeuroData (http://neurodata.io)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# test_qa_graphs.py
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+import networkx as nx
+import os.path as op
+
+from ndmg.stats.qa_graphs import scan_statistic, compute_metrics
+from ndmg.stats.metric_store import load_index, load_record
+
+
+def random_graph(n, p, seed):
+    """
+    Random graph with integer node labels in shuffled order, random weights
+    and a few self-loops.
+    """
+    rng = np.random.RandomState(seed)
+    g = nx.Graph()
+    g.add_nodes_from(rng.permutation(n) + 1)
+    for u, v in nx.gnp_random_graph(n, p, seed=seed).edges():
+        g.add_edge(u + 1, v + 1, weight=rng.randint(1, 100))
+    for u in rng.choice(n, n // 5, replace=False):
+        g.add_edge(u + 1, u + 1, weight=rng.randint(1, 100))
+    return g
+
+
+class scan_statistic_test(unittest.TestCase):
+    def test_ego_graph(self):
+        graphs = dict(('g{}'.format(s), random_graph(40, p, s))
+                      for s, p in enumerate([0.02, 0.08, 0.3]))
+        for i in [1, 2]:
+            ss = scan_statistic(graphs, i, nproc=1)
+            for key, g in graphs.items():
+                expected = [sum(d['weight'] for u, v, d in
+                                nx.ego_graph(g, n, radius=i).edges(data=True))
+                            for n in g.nodes()]
+                np.testing.assert_allclose(ss[key], expected)
+
+
+class compute_metrics_test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fs = list()
+        for s in range(3):
+            f = op.join(self.tmpdir, 'sub-{}_graph.edgelist'.format(s))
+            nx.write_weighted_edgelist(random_graph(30, 0.3, s), f)
+            self.fs += [f]
+        self.outdir = op.join(self.tmpdir, 'out')
+        self.storedir = op.join(self.outdir, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parameters(self):
+        compute_metrics(self.fs, self.outdir, 'atlas', bc_budget=None,
+                        nproc=1)
+        subj = op.basename(self.fs[0])
+        self.assertEqual(len(load_record(self.storedir, subj)['metrics']
+                             ['eigen_sequence']), 30)
+        # Changing the metric parameters must not reuse stored results
+        compute_metrics(self.fs, self.outdir, 'atlas', neigs=5,
+                        bc_budget=None, nproc=1)
+        self.assertEqual(load_index(self.storedir)['params'],
+                         {'neigs': 5, 'bc_budget': None})
+        self.assertEqual(len(load_record(self.storedir, subj)['metrics']
+                             ['eigen_sequence']), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()